@@ -0,0 +1,264 @@
+# API Key Management System - Load Test Benchmark
+#
+# Drives the Flask app in API_Key_Management.py end to end (validation,
+# permission check, rate limiting, usage logging and last-used updates) with
+# concurrent valid, invalid and revoked keys. Reports p50/p99 latency,
+# throughput and SQLite lock waits per key-count scenario and saves them as
+# JSON; pass --baseline with an earlier result file to flag regressions.
+#
+#   python API_Key_Benchmark.py --keys 1 1000 100000 --requests 5000 \
+#       --concurrency 32 --output bench.json --baseline bench_previous.json
+
+import argparse
+import json
+import os
+import platform
+import random
+import secrets
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+import API_Key_Management as akm
+from API_Key_Management import (
+    APIKeyConfig,
+    APIKeyManager,
+    SQLiteRateLimiter,
+    VerifiedKeyCache,
+)
+
+TRAFFIC_KEYS = 16  # keys of each kind the load is spread over
+KINDS = ("valid", "invalid", "revoked")
+ENDPOINT = "/api/data"
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def seed_keys(manager: APIKeyManager, total_keys: int, hash_rounds: int) -> Dict[str, List[str]]:
+    """Create total_keys rows and return the key strings to send, by kind.
+
+    Keys that receive traffic are generated normally at hash_rounds. The
+    remaining filler rows only exist to give the table a realistic size; they
+    are never presented, so they get unique placeholder hashes instead of
+    paying for bcrypt.
+    """
+    valid_count = min(TRAFFIC_KEYS, total_keys)
+    revoked_count = min(TRAFFIC_KEYS, total_keys - valid_count)
+    filler_count = total_keys - valid_count - revoked_count
+
+    for start in range(0, filler_count, APIKeyConfig.MAX_BULK_KEYS):
+        batch = []
+        for i in range(start, min(filler_count, start + APIKeyConfig.MAX_BULK_KEYS)):
+            _, _, api_key = manager._draft_api_key(f"filler-{i}", f"tenant-{i % 1000}")
+            api_key.key_hash = "$2b$04$placeholder." + secrets.token_hex(24)
+            batch.append(api_key)
+        manager._store_api_keys(batch)
+
+    rate_limit = 10 ** 9  # measure the limiter's cost, not 429s
+    valid = [key for key, _ in manager.generate_api_keys(
+        valid_count, "bench", "bench-user", ["read"], rate_limit,
+        hash_rounds=hash_rounds, min_hash_rounds=hash_rounds)]
+    revoked = []
+    if revoked_count:
+        generated = manager.generate_api_keys(
+            revoked_count, "revoked", "bench-user", ["read"], rate_limit,
+            hash_rounds=hash_rounds, min_hash_rounds=hash_rounds)
+        manager.revoke_api_keys([api_key.id for _, api_key in generated])
+        revoked = [key for key, _ in generated]
+
+    # Half wrong secrets for real ids (one bcrypt each), half unknown ids
+    invalid = []
+    for i, key in enumerate(valid):
+        key_id = key[len(APIKeyConfig.PREFIX):].split(APIKeyConfig.ID_SEPARATOR)[0]
+        if i % 2:
+            key_id = secrets.token_urlsafe(16)
+        invalid.append(APIKeyConfig.PREFIX + key_id + APIKeyConfig.ID_SEPARATOR
+                       + secrets.token_urlsafe(APIKeyConfig.KEY_LENGTH))
+
+    return {"valid": valid, "invalid": invalid, "revoked": revoked}
+
+def run_load(keys_by_kind: Dict[str, List[str]], mix: Dict[str, float],
+             requests: int, concurrency: int, seed: int) -> tuple[list, float]:
+    """Send requests through the Flask test client from concurrency threads"""
+    rng = random.Random(seed)
+    kinds = [kind for kind in KINDS if keys_by_kind[kind] and mix.get(kind)]
+    schedule = [
+        (kind, rng.choice(keys_by_kind[kind]))
+        for kind in rng.choices(kinds, weights=[mix[kind] for kind in kinds], k=requests)
+    ]
+    chunks = [schedule[i::concurrency] for i in range(concurrency)]
+
+    def worker(chunk):
+        client = akm.app.test_client()
+        samples = []
+        for kind, key in chunk:
+            started = time.perf_counter()
+            response = client.get(ENDPOINT, headers={"Authorization": f"Bearer {key}"})
+            samples.append((kind, time.perf_counter() - started, response.status_code))
+        return samples
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = [sample for chunk in pool.map(worker, chunks) for sample in chunk]
+    return samples, time.perf_counter() - started
+
+def summarize(samples: list) -> Dict[str, Dict]:
+    summary = {}
+    for kind in KINDS:
+        latencies = sorted(latency for k, latency, _ in samples if k == kind)
+        if not latencies:
+            continue
+        statuses = {}
+        for k, _, status_code in samples:
+            if k == kind:
+                statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+        summary[kind] = {
+            "count": len(latencies),
+            "p50_ms": 1000 * percentile(latencies, 50),
+            "p90_ms": 1000 * percentile(latencies, 90),
+            "p99_ms": 1000 * percentile(latencies, 99),
+            "max_ms": 1000 * latencies[-1],
+            "status_codes": statuses,
+        }
+    return summary
+
+# Stats fields that describe current state rather than accumulate
+GAUGES = {"opened", "size", "max_entries", "queued", "running", "max_workers", "max_pending", "keys"}
+
+def counter_delta(after: Dict, before: Dict) -> Dict:
+    """Counters accumulated during the load phase; gauges are reported as-is"""
+    return {name: value if name in GAUGES else value - before.get(name, 0)
+            for name, value in after.items()}
+
+def run_scenario(total_keys: int, args, workdir: str) -> Dict:
+    db_path = os.path.join(workdir, f"bench_{total_keys}.db")
+    manager = APIKeyManager(db_path, rate_limiter=SQLiteRateLimiter(db_path))
+    if args.no_cache:
+        manager.key_cache = VerifiedKeyCache(ttl_seconds=0)
+    akm.api_manager = manager  # require_api_key looks the manager up per request
+
+    seed_started = time.perf_counter()
+    keys_by_kind = seed_keys(manager, total_keys, args.hash_rounds)
+    seed_seconds = time.perf_counter() - seed_started
+    manager.usage_writer.flush()
+    before = manager.stats()
+
+    mix = dict(zip(KINDS, args.mix))
+    samples, wall_seconds = run_load(keys_by_kind, mix, args.requests, args.concurrency, args.seed)
+    manager.usage_writer.flush()
+    after = manager.stats()
+    manager.close()
+
+    latencies = sorted(latency for _, latency, _ in samples)
+    return {
+        "keys": total_keys,
+        "seed_seconds": seed_seconds,
+        "requests": len(samples),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(samples) / wall_seconds if wall_seconds else 0.0,
+        "overall": {
+            "p50_ms": 1000 * percentile(latencies, 50),
+            "p99_ms": 1000 * percentile(latencies, 99),
+        },
+        "by_kind": summarize(samples),
+        "sqlite": counter_delta(after["sqlite"], before["sqlite"]),
+        "rate_limiter_sqlite": counter_delta(after["rate_limiter"], before["rate_limiter"]),
+        "lock_waits": (after["sqlite"]["lock_waits"] - before["sqlite"]["lock_waits"]
+                       + after["rate_limiter"]["lock_waits"] - before["rate_limiter"]["lock_waits"]),
+        "key_cache": counter_delta(after["key_cache"], before["key_cache"]),
+        "hasher": after["hasher"],
+        "usage_writer": counter_delta(after["usage_writer"], before["usage_writer"]),
+    }
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions of p50/p99 latency or throughput beyond tolerance"""
+    previous = {scenario["keys"]: scenario for scenario in baseline.get("scenarios", [])}
+    regressions = []
+    for scenario in results["scenarios"]:
+        old = previous.get(scenario["keys"])
+        if old is None:
+            continue
+        label = f"{scenario['keys']} keys"
+        if scenario["throughput_rps"] < old["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {old['throughput_rps']:.0f} -> "
+                               f"{scenario['throughput_rps']:.0f} req/s")
+        for kind, stats in scenario["by_kind"].items():
+            for metric in ("p50_ms", "p99_ms"):
+                before = old["by_kind"].get(kind, {}).get(metric)
+                if before and stats[metric] > before * (1 + tolerance):
+                    regressions.append(f"{label} {kind}: {metric} {before:.2f} -> {stats[metric]:.2f}")
+    return regressions
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the require_api_key path")
+    parser.add_argument("--keys", type=int, nargs="+", default=[1, 1000, 100000],
+                        help="total keys in the database, one scenario per value")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", type=float, nargs=3, default=[0.80, 0.15, 0.05],
+                        metavar=("VALID", "INVALID", "REVOKED"),
+                        help="relative share of each kind of key in the traffic")
+    parser.add_argument("--hash-rounds", type=int, default=APIKeyConfig.HASH_ROUNDS,
+                        help="bcrypt cost of the keys that receive traffic")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="disable the verified-key cache to measure the cold path")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default="bench_api_keys.json")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed relative slowdown before a change counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = {
+        "benchmark": "api_key_auth",
+        "created_at": datetime.utcnow().isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cpus": os.cpu_count(),
+        "config": vars(args),
+        "scenarios": [],
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for total_keys in args.keys:
+            scenario = run_scenario(total_keys, args, workdir)
+            results["scenarios"].append(scenario)
+            print(f"{total_keys:>8} keys: {scenario['throughput_rps']:8.1f} req/s  "
+                  f"p50 {scenario['overall']['p50_ms']:7.2f} ms  "
+                  f"p99 {scenario['overall']['p99_ms']:7.2f} ms  "
+                  f"lock waits {scenario['lock_waits']}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,23 @@
 # API Key Management System - Complete Implementation
 
+import asyncio
+import atexit
 import hashlib
+import json
+import math
+import os
+import queue
 import secrets
+import threading
 import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from typing import Awaitable, Callable, Optional, Dict, List
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 import sqlite3
 import bcrypt
 from functools import wraps
@@ -16,9 +27,66 @@ import logging
 class APIKeyConfig:
     KEY_LENGTH = 32
     PREFIX = "sk-"  # Similar to OpenAI's format
+    ID_SEPARATOR = "."  # sk-<key id>.<secret>; never produced by token_urlsafe
     HASH_ROUNDS = 12
+    # bcrypt runs on a bounded pool instead of the request thread/event loop
+    HASH_POOL_WORKERS = os.cpu_count() or 4
+    HASH_POOL_MAX_PENDING = 256  # submitted but unfinished hash jobs
+    HASH_POOL_TIMEOUT = 30.0  # seconds to wait for a free slot or a result
     DEFAULT_RATE_LIMIT = 1000  # requests per hour
+    RATE_LIMIT_WINDOW_SECONDS = 3600
+    RATE_LIMIT_STRIPES = 64  # lock stripes for in-memory counters (power of two)
+    RATE_LIMIT_MAX_KEYS = 1_000_000  # in-memory counters kept before forced eviction
+    RATE_LIMIT_SWEEP_SECONDS = 60  # how often idle counters are evicted
     DEFAULT_EXPIRY_DAYS = 365
+    MAX_BULK_KEYS = 10000  # per generate_api_keys call / bulk admin request
+    MIN_BULK_HASH_ROUNDS = 10  # lowest bcrypt cost generate_api_keys accepts
+    # Keys issued before the "sk-<id>.<secret>" format carry no identifier and
+    # can only be found by scanning. Set to False once all of them are migrated.
+    ALLOW_LEGACY_KEYS = True
+    # Any "sk-" string without an id looks like a legacy key, so scans are bounded
+    LEGACY_SCAN_MAX_CONCURRENT = 2  # scans running at once; extra attempts are rejected
+    LEGACY_SCANS_PER_CLIENT = 10  # scans per client per LEGACY_SCAN_WINDOW_SECONDS
+    LEGACY_SCAN_WINDOW_SECONDS = 60
+    LEGACY_FAILURE_CACHE_SIZE = 10000  # digests of keys that failed a scan
+    LEGACY_FAILURE_TTL_SECONDS = 600
+    # Verified-key cache: repeat requests skip SQLite and bcrypt. Revocations
+    # made by another process are read from api_key_revocations and evicted
+    # within REVOCATION_POLL_SECONDS.
+    CACHE_MAX_ENTRIES = 10000
+    CACHE_TTL_SECONDS = 300
+    REVOCATION_POLL_SECONDS = 1.0
+    # SQLite connection pool: WAL lets readers proceed while usage writes commit
+    SQLITE_POOL_SIZE = 8
+    SQLITE_BUSY_TIMEOUT = 5.0  # seconds to wait on a locked database
+    SQLITE_SYNCHRONOUS = "NORMAL"  # durable across app crashes in WAL mode
+    SQLITE_STATEMENT_CACHE = 256  # prepared statements kept per connection
+    SQLITE_LOCK_WAIT_THRESHOLD = 0.001  # BEGIN IMMEDIATE slower than this counts as a lock wait
+    # Background usage writer: one transaction per batch, off the request path
+    USAGE_QUEUE_SIZE = 10000
+    USAGE_BATCH_SIZE = 500
+    USAGE_FLUSH_INTERVAL = 1.0  # seconds a partial batch may wait
+    USAGE_PUT_TIMEOUT = 0.05  # back-pressure wait before an event is dropped
+    # Prometheus metrics for the Flask app below (served on /metrics)
+    METRICS_ENABLED = os.getenv("API_KEY_METRICS", "0") == "1"
+    # Usage analytics retention; hour and day rollups are kept indefinitely
+    USAGE_LOG_RETENTION_DAYS = 30
+    MINUTE_ROLLUP_RETENTION_DAYS = 7
+    USAGE_PRUNE_BATCH_SIZE = 10000  # rows deleted per transaction when pruning
+    USAGE_REBUILD_SLICE_HOURS = 1  # hours of raw logs re-aggregated per transaction
+
+# Key format versions stored in api_keys.key_version
+LEGACY_KEY_VERSION = 1  # sk-<secret>, bcrypt over the whole key
+ID_SECRET_KEY_VERSION = 2  # sk-<id>.<secret>, bcrypt over the secret only
+
+# Usage rollup bucket formats, shared by Python (datetime.strftime) and SQL
+# (strftime) so incremental and rebuilt rollups land in the same buckets
+ROLLUP_BUCKET_FORMATS = {
+    "minute": "%Y-%m-%d %H:%M:00",
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d 00:00:00",
+}
+USAGE_GROUP_COLUMNS = ("bucket_start", "api_key_id", "endpoint", "response_code")
 
 class APIKeyStatus(Enum):
     ACTIVE = "active"
@@ -45,53 +113,1042 @@ class RateLimitInfo:
     requests_made: int
     window_start: datetime
     limit: int
+    retry_after: float = 0.0  # seconds until the next request would be allowed
+
+class VerifiedKeyCache:
+    """Bounded LRU/TTL cache of successfully verified API keys.
+    
+    Entries are keyed by a SHA-256 digest of the presented key string, so the
+    plaintext key is never held, and expire at the earlier of the TTL and the
+    key's own expires_at.
+    """
+    
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None):
+        self.max_entries = max_entries or APIKeyConfig.CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else APIKeyConfig.CACHE_TTL_SECONDS
+        self._entries = OrderedDict()  # digest -> (APIKey, expires_at monotonic)
+        self._digests_by_key_id = {}  # api_key_id -> set of digests
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def digest(key_string: str) -> bytes:
+        return hashlib.sha256(key_string.encode()).digest()
+    
+    def get(self, key_string: str) -> Optional[APIKey]:
+        digest = self.digest(key_string)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            api_key, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(digest)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return api_key
+    
+    def put(self, key_string: str, api_key: APIKey):
+        ttl = self.ttl_seconds
+        if api_key.expires_at is not None:
+            ttl = min(ttl, (api_key.expires_at - datetime.utcnow()).total_seconds())
+        if ttl <= 0:
+            return
+        
+        digest = self.digest(key_string)
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            self._entries[digest] = (api_key, time.monotonic() + ttl)
+            self._digests_by_key_id.setdefault(api_key.id, set()).add(digest)
+            
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+    
+    def evict_key_id(self, api_key_id: str) -> int:
+        """Drop every cached entry for an API key id (e.g. after revocation)"""
+        with self._lock:
+            digests = self._digests_by_key_id.pop(api_key_id, set())
+            for digest in digests:
+                self._entries.pop(digest, None)
+            self.evictions += len(digests)
+            return len(digests)
+    
+    def clear(self):
+        with self._lock:
+            self.evictions += len(self._entries)
+            self._entries.clear()
+            self._digests_by_key_id.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+    
+    def _remove(self, digest: bytes):
+        """Remove one entry; caller must hold the lock"""
+        api_key, _ = self._entries.pop(digest)
+        digests = self._digests_by_key_id.get(api_key.id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._digests_by_key_id[api_key.id]
+
+class SQLiteConnectionPool:
+    """Bounded pool of long-lived SQLite connections.
+    
+    Connections are opened lazily up to pool_size and reused across requests,
+    each configured once with WAL journaling, the synchronous level, a busy
+    timeout and a prepared-statement cache. Callers borrow one through
+    connection() for reads or transaction() for writes.
+    
+    Write transactions take the write lock up front with BEGIN IMMEDIATE, so
+    waiting for it goes through the busy timeout instead of failing on a
+    read-to-write upgrade, and the time spent waiting is counted in stats().
+    """
+    
+    def __init__(self, db_path: str, pool_size: int = None):
+        self.db_path = db_path
+        self.pool_size = pool_size or APIKeyConfig.SQLITE_POOL_SIZE
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self.pool_waits = 0
+        self.lock_waits = 0
+        self.lock_wait_seconds = 0.0
+        self.busy_errors = 0
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=APIKeyConfig.SQLITE_BUSY_TIMEOUT,
+            cached_statements=APIKeyConfig.SQLITE_STATEMENT_CACHE,
+            check_same_thread=False  # connections move between threads via the pool
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={APIKeyConfig.SQLITE_SYNCHRONOUS}")
+        return conn
+    
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError(f"Connection pool for {self.db_path} is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            can_open = self._opened < self.pool_size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        
+        # Pool exhausted: wait for another thread to hand a connection back
+        with self._lock:
+            self.pool_waits += 1
+        try:
+            return self._idle.get(timeout=APIKeyConfig.SQLITE_BUSY_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(
+                f"All {self.pool_size} SQLite connections stayed busy for "
+                f"{APIKeyConfig.SQLITE_BUSY_TIMEOUT}s") from None
+    
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put(conn)
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for reads"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+    
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and commit on success, roll back on error"""
+        with self.connection() as conn:
+            started = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError:
+                with self._lock:
+                    self.busy_errors += 1
+                raise
+            waited = time.perf_counter() - started
+            if waited > APIKeyConfig.SQLITE_LOCK_WAIT_THRESHOLD:
+                with self._lock:
+                    self.lock_waits += 1
+                    self.lock_wait_seconds += waited
+            
+            with conn:
+                yield conn
+    
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "opened": self._opened,
+                "pool_waits": self.pool_waits,
+                "lock_waits": self.lock_waits,
+                "lock_wait_ms": 1000 * self.lock_wait_seconds,
+                "busy_errors": self.busy_errors,
+            }
+    
+    def close_all(self):
+        """Close idle connections (borrowed ones are closed when returned later)"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+class UsageLogWriter:
+    """Background writer for api_usage_logs rows and last_used/usage_count updates.
+    
+    Request threads enqueue events into a bounded queue and return at once.
+    A single writer thread flushes them in one transaction per batch, either
+    when USAGE_BATCH_SIZE events are pending or USAGE_FLUSH_INTERVAL has
+    passed. When the queue is full, producers wait up to USAGE_PUT_TIMEOUT
+    and then drop the event, which is counted in stats()["dropped"].
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, db: SQLiteConnectionPool, max_queue: int = None,
+                 batch_size: int = None, flush_interval: float = None):
+        self._db = db
+        self.batch_size = batch_size or APIKeyConfig.USAGE_BATCH_SIZE
+        self.flush_interval = flush_interval or APIKeyConfig.USAGE_FLUSH_INTERVAL
+        self._queue = queue.Queue(maxsize=max_queue or APIKeyConfig.USAGE_QUEUE_SIZE)
+        self._closed = False
+        self._producers = 0  # _put calls between the _closed check and the queue put
+        self._producers_done = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, name="usage-log-writer", daemon=True)
+        self._thread.start()
+    
+    def log_usage(self, api_key_id: str, endpoint: str, method: str, timestamp: datetime,
+                  ip_address: str = None, user_agent: str = None,
+                  response_code: int = 200, block: bool = True) -> bool:
+        return self._put(("log", (api_key_id, endpoint, method, timestamp,
+                                  ip_address, user_agent, response_code)), block)
+    
+    def touch_key(self, api_key_id: str, timestamp: datetime, block: bool = True) -> bool:
+        return self._put(("touch", api_key_id, timestamp), block)
+    
+    def _put(self, event, block: bool = True) -> bool:
+        """Enqueue an event; block=False (for event loops) drops at once when full"""
+        if self._enter():
+            try:
+                self._queue.put(event, block, APIKeyConfig.USAGE_PUT_TIMEOUT)
+                with self._stats_lock:
+                    self.enqueued += 1
+                return True
+            except queue.Full:
+                pass
+            finally:
+                self._leave()
+        with self._stats_lock:
+            self.dropped += 1
+        return False
+    
+    def _enter(self) -> bool:
+        """Register a producer unless closed, so close() cannot put _STOP ahead of it"""
+        with self._producers_done:
+            if self._closed:
+                return False
+            self._producers += 1
+            return True
+    
+    def _leave(self):
+        with self._producers_done:
+            self._producers -= 1
+            if not self._producers:
+                self._producers_done.notify_all()
+    
+    def flush(self, timeout: float = None) -> bool:
+        """Block until everything enqueued so far has been written"""
+        if not self._enter():
+            return True  # close() already drained the queue
+        done = threading.Event()
+        try:
+            self._queue.put(done)
+        finally:
+            self._leave()
+        return done.wait(timeout)
+    
+    def close(self, timeout: float = None):
+        """Stop accepting events, drain the queue and stop the writer thread"""
+        with self._producers_done:
+            if self._closed:
+                return
+            self._closed = True
+            # Producers already past the check finish their put before _STOP
+            self._producers_done.wait_for(lambda: not self._producers)
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+    
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {
+                "queued": self._queue.qsize(),
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "written": self.written,
+                "failed": self.failed,
+                "batches": self.batches,
+            }
+    
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                event = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                event = None
+            
+            if event is self._STOP:
+                self._write(batch)
+                return
+            if isinstance(event, threading.Event):
+                self._write(batch)
+                batch = []
+                event.set()
+                continue
+            
+            if event is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(event)
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+    
+    def _write(self, batch: list):
+        if not batch:
+            return
+        
+        logs = []
+        touches = {}  # api_key_id -> [count, last_used_at]
+        for event in batch:
+            if event[0] == "log":
+                logs.append(event[1])
+            else:
+                _, api_key_id, timestamp = event
+                touch = touches.setdefault(api_key_id, [0, timestamp])
+                touch[0] += 1
+                touch[1] = max(touch[1], timestamp)
+        
+        try:
+            with self._db.transaction() as conn:
+                if logs:
+                    conn.executemany("""
+                        INSERT INTO api_usage_logs 
+                        (api_key_id, endpoint, method, timestamp, ip_address, user_agent, response_code)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, logs)
+                if touches:
+                    conn.executemany("""
+                        UPDATE api_keys 
+                        SET last_used_at = ?, usage_count = usage_count + ?
+                        WHERE id = ?
+                    """, [(last_used, count, api_key_id)
+                          for api_key_id, (count, last_used) in touches.items()])
+                if logs:
+                    conn.executemany("""
+                        INSERT INTO api_usage_rollups
+                        (granularity, bucket_start, api_key_id, endpoint, response_code, count)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (granularity, bucket_start, api_key_id, endpoint, response_code)
+                        DO UPDATE SET count = count + excluded.count
+                    """, [key + (count,) for key, count in self._rollup(logs).items()])
+        except sqlite3.Error:
+            self.logger.exception("Failed to write %d usage events", len(batch))
+            with self._stats_lock:
+                self.failed += len(batch)
+            return
+        
+        with self._stats_lock:
+            self.written += len(batch)
+            self.batches += 1
+    
+    @staticmethod
+    def _rollup(logs: list) -> Dict[tuple, int]:
+        """Aggregate log rows into (granularity, bucket, key, endpoint, code) counts"""
+        counts = {}
+        for api_key_id, endpoint, _, timestamp, _, _, response_code in logs:
+            for granularity, bucket_format in ROLLUP_BUCKET_FORMATS.items():
+                key = (granularity, timestamp.strftime(bucket_format), api_key_id,
+                       endpoint, response_code or 0)
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+def sliding_window_decision(previous_count: int, current_count: int, elapsed: float,
+                            window: float, limit: int) -> tuple[bool, float, float]:
+    """Sliding-window counter check.
+    
+    The request rate is estimated as the previous fixed window's count,
+    weighted by how much of it still overlaps the sliding window, plus the
+    current window's count. Unlike plain fixed windows this does not allow a
+    2x burst across a window boundary.
+    
+    Returns (allowed, estimated requests including this one, retry_after).
+    """
+    estimated = previous_count * (1 - elapsed / window) + current_count
+    if estimated + 1 <= limit:
+        return True, estimated + 1, 0.0
+    
+    if current_count < limit and previous_count > 0:
+        # Wait for the previous window's weight to decay enough
+        free_at = window * (1 - (limit - 1 - current_count) / previous_count)
+        retry_after = free_at - elapsed
+    else:
+        # This window alone is full: wait for it to roll over and decay
+        decay = window * (1 - (limit - 1) / current_count) if current_count else 0.0
+        retry_after = (window - elapsed) + max(0.0, decay)
+    return False, estimated, max(retry_after, 0.0)
+
+class RateLimiter(ABC):
+    """Rate limit backend interface used by APIKeyManager.check_rate_limit"""
+    
+    def __init__(self, window_seconds: int = None):
+        self.window_seconds = window_seconds or APIKeyConfig.RATE_LIMIT_WINDOW_SECONDS
+    
+    @abstractmethod
+    def hit(self, key_id: str, limit: int) -> tuple[bool, RateLimitInfo]:
+        """Count one request for key_id if it is within limit"""
+    
+    def close(self):
+        """Release background threads or connections held by the backend"""
+    
+    def stats(self) -> Dict[str, float]:
+        return {}
+    
+    def _window(self, now: float) -> tuple[int, float]:
+        """Current fixed window index and seconds elapsed within it"""
+        index = int(now // self.window_seconds)
+        return index, now - index * self.window_seconds
+    
+    def _info(self, index: int, requests_made: float, limit: int, retry_after: float) -> RateLimitInfo:
+        return RateLimitInfo(
+            requests_made=math.ceil(requests_made),
+            window_start=datetime.utcfromtimestamp(index * self.window_seconds),
+            limit=limit,
+            retry_after=retry_after
+        )
+
+class _WindowCounter:
+    """Sliding-window state for one key: two counts and the window they belong to"""
+    __slots__ = ("window_index", "previous", "current")
+    
+    def __init__(self, window_index: int):
+        self.window_index = window_index
+        self.previous = 0
+        self.current = 0
+    
+    def roll(self, index: int):
+        if self.window_index != index:
+            # Roll forward; anything older than one window no longer counts
+            self.previous = self.current if self.window_index == index - 1 else 0
+            self.current = 0
+            self.window_index = index
+
+class InMemoryRateLimiter(RateLimiter):
+    """Sliding-window limiter for a single process.
+    
+    Counters are spread over RATE_LIMIT_STRIPES dicts, each guarded by its
+    own lock and chosen by key hash, so threads checking different keys
+    rarely contend. A background thread evicts counters idle for a full
+    window (they would count as zero anyway), keeping memory proportional to
+    recently active keys. max_keys caps the total as a last resort, evicting
+    the oldest counters first, which only ever makes a limit more lenient.
+    """
+    
+    def __init__(self, window_seconds: int = None, stripes: int = None,
+                 max_keys: int = None, sweep_seconds: float = None):
+        super().__init__(window_seconds)
+        stripes = stripes or APIKeyConfig.RATE_LIMIT_STRIPES
+        self._mask = stripes - 1
+        assert stripes & self._mask == 0, "stripes must be a power of two"
+        self._stripes = [{} for _ in range(stripes)]  # key_id -> _WindowCounter
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._max_per_stripe = max(1, (max_keys or APIKeyConfig.RATE_LIMIT_MAX_KEYS) // stripes)
+        self._evictions = [0] * stripes  # per stripe, updated under that stripe's lock
+        
+        self._stop = threading.Event()
+        self._sweep_seconds = sweep_seconds or APIKeyConfig.RATE_LIMIT_SWEEP_SECONDS
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="rate-limit-sweeper", daemon=True)
+        self._sweeper.start()
+    
+    def hit(self, key_id: str, limit: int) -> tuple[bool, RateLimitInfo]:
+        index, elapsed = self._window(time.time())
+        stripe_no = hash(key_id) & self._mask
+        counters = self._stripes[stripe_no]
+        
+        with self._locks[stripe_no]:
+            counter = counters.get(key_id)
+            if counter is None:
+                if len(counters) >= self._max_per_stripe:
+                    self._make_room(stripe_no, index)
+                counter = counters[key_id] = _WindowCounter(index)
+            counter.roll(index)
+            
+            allowed, estimated, retry_after = sliding_window_decision(
+                counter.previous, counter.current, elapsed, self.window_seconds, limit)
+            if allowed:
+                counter.current += 1
+        
+        return allowed, self._info(index, estimated, limit, retry_after)
+    
+    def __len__(self) -> int:
+        return sum(len(counters) for counters in self._stripes)
+    
+    def evict_idle(self) -> int:
+        """Drop counters with no requests in the current or previous window"""
+        index, _ = self._window(time.time())
+        evicted = 0
+        for stripe_no, (counters, lock) in enumerate(zip(self._stripes, self._locks)):
+            # One stripe at a time so hits on other stripes keep flowing
+            with lock:
+                idle = [key_id for key_id, counter in counters.items()
+                        if counter.window_index < index - 1]
+                for key_id in idle:
+                    del counters[key_id]
+                self._evictions[stripe_no] += len(idle)
+            evicted += len(idle)
+        return evicted
+    
+    def _make_room(self, stripe_no: int, index: int):
+        """Free one slot in a full stripe; caller must hold the stripe lock"""
+        counters = self._stripes[stripe_no]
+        idle = [key_id for key_id, counter in counters.items()
+                if counter.window_index < index - 1]
+        for key_id in idle or [next(iter(counters))]:
+            del counters[key_id]
+        self._evictions[stripe_no] += max(1, len(idle))
+    
+    @property
+    def evictions(self) -> int:
+        return sum(self._evictions)
+    
+    def stats(self) -> Dict[str, float]:
+        return {"keys": len(self), "evictions": self.evictions}
+    
+    def _sweep_loop(self):
+        while not self._stop.wait(self._sweep_seconds):
+            self.evict_idle()
+    
+    def close(self):
+        self._stop.set()
+
+class SQLiteRateLimiter(RateLimiter):
+    """Sliding-window limiter whose counters live in SQLite.
+    
+    Every worker process on the host that points at the same database file
+    enforces one shared limit. Each check is a single write transaction
+    (BEGIN IMMEDIATE), so concurrent workers cannot both take the last slot.
+    """
+    
+    def __init__(self, db_path: str = "api_keys.db", window_seconds: int = None):
+        super().__init__(window_seconds)
+        self._db = SQLiteConnectionPool(db_path)
+        with self._db.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limit_counters (
+                    key_id TEXT NOT NULL,
+                    window_index INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (key_id, window_index)
+                ) WITHOUT ROWID
+            """)
+    
+    def hit(self, key_id: str, limit: int) -> tuple[bool, RateLimitInfo]:
+        index, elapsed = self._window(time.time())
+        
+        with self._db.transaction() as conn:
+            counts = dict(conn.execute("""
+                SELECT window_index, count FROM rate_limit_counters
+                WHERE key_id = ? AND window_index >= ?
+            """, (key_id, index - 1)).fetchall())
+            
+            allowed, estimated, retry_after = sliding_window_decision(
+                counts.get(index - 1, 0), counts.get(index, 0),
+                elapsed, self.window_seconds, limit)
+            
+            if allowed:
+                conn.execute("""
+                    INSERT INTO rate_limit_counters (key_id, window_index, count)
+                    VALUES (?, ?, 1)
+                    ON CONFLICT (key_id, window_index) DO UPDATE SET count = count + 1
+                """, (key_id, index))
+            # Drop windows that can no longer count (a primary-key range delete)
+            conn.execute("""
+                DELETE FROM rate_limit_counters WHERE key_id = ? AND window_index < ?
+            """, (key_id, index - 1))
+        
+        return allowed, self._info(index, estimated, limit, retry_after)
+    
+    def stats(self) -> Dict[str, float]:
+        return self._db.stats()
+    
+    def close(self):
+        self._db.close_all()
+
+class BcryptWorkerPool:
+    """Bounded thread pool for bcrypt hashing and verification.
+    
+    bcrypt releases the GIL while it works, so a thread pool gives real
+    parallelism without the pickling cost of a process pool. At most
+    max_pending jobs may be queued or running; further submitters wait for a
+    slot (up to HASH_POOL_TIMEOUT), which keeps CPU use and latency bounded
+    under bursts. Every operation has a blocking and an awaitable form.
+    """
+    
+    def __init__(self, max_workers: int = None, max_pending: int = None):
+        self.max_workers = max_workers or APIKeyConfig.HASH_POOL_WORKERS
+        self.max_pending = max_pending or APIKeyConfig.HASH_POOL_MAX_PENDING
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats_lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.peak_queued = 0
+        self.total_wait_seconds = 0.0
+    
+    def submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(timeout=APIKeyConfig.HASH_POOL_TIMEOUT):
+            raise TimeoutError("bcrypt worker pool is saturated")
+        return self._submit(fn, *args)
+    
+    async def submit_async(self, fn, *args):
+        # Only leave the event loop to wait for a slot when the pool is full
+        if not self._slots.acquire(blocking=False):
+            waiter = asyncio.ensure_future(
+                asyncio.to_thread(self._slots.acquire, timeout=APIKeyConfig.HASH_POOL_TIMEOUT))
+            try:
+                acquired = await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                # The thread keeps waiting and may still take a slot nobody will use
+                waiter.add_done_callback(self._release_abandoned)
+                raise
+            if not acquired:
+                raise TimeoutError("bcrypt worker pool is saturated")
+        return await asyncio.wrap_future(self._submit(fn, *args))
+    
+    def _release_abandoned(self, waiter: asyncio.Future):
+        if not waiter.cancelled() and waiter.exception() is None and waiter.result():
+            self._slots.release()
+    
+    def _submit(self, fn, *args) -> Future:
+        """Submit a job that already holds a slot"""
+        with self._stats_lock:
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+        try:
+            future = self._executor.submit(self._run, time.perf_counter(), fn, *args)
+        except BaseException:
+            with self._stats_lock:
+                self.queued -= 1
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+    
+    def _run(self, submitted_at: float, fn, *args):
+        with self._stats_lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait_seconds += time.perf_counter() - submitted_at
+        try:
+            return fn(*args)
+        finally:
+            with self._stats_lock:
+                self.running -= 1
+                self.completed += 1
+    
+    @staticmethod
+    def _hash(secret: str, rounds: int) -> str:
+        return bcrypt.hashpw(secret.encode(), bcrypt.gensalt(rounds=rounds)).decode()
+    
+    @staticmethod
+    def _verify(secret: str, hashed: str) -> bool:
+        return bcrypt.checkpw(secret.encode(), hashed.encode())
+    
+    def hash(self, secret: str, rounds: int = None) -> str:
+        return self.submit(self._hash, secret, rounds or APIKeyConfig.HASH_ROUNDS).result(
+            APIKeyConfig.HASH_POOL_TIMEOUT)
+    
+    def verify(self, secret: str, hashed: str) -> bool:
+        return self.submit(self._verify, secret, hashed).result(APIKeyConfig.HASH_POOL_TIMEOUT)
+    
+    def hash_many(self, values: List[str], rounds: int = None) -> List[str]:
+        """Hash many secrets in parallel, in order; submission waits while the pool is full"""
+        rounds = rounds or APIKeyConfig.HASH_ROUNDS
+        futures = [self.submit(self._hash, value, rounds) for value in values]
+        return [future.result(APIKeyConfig.HASH_POOL_TIMEOUT) for future in futures]
+    
+    async def hash_async(self, secret: str, rounds: int = None) -> str:
+        return await self.submit_async(self._hash, secret, rounds or APIKeyConfig.HASH_ROUNDS)
+    
+    async def verify_async(self, secret: str, hashed: str) -> bool:
+        return await self.submit_async(self._verify, secret, hashed)
+    
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            started = self.completed + self.running
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "peak_queued": self.peak_queued,
+                "avg_queue_wait_ms": 1000 * self.total_wait_seconds / started if started else 0.0,
+            }
+    
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+class Metrics:
+    """Metrics/tracing sink for the auth hot path.
+    
+    This base class is the no-op default: timer() hands back one shared
+    null context and the other hooks return immediately, so instrumentation
+    costs a method call when disabled. Subclass it to export elsewhere
+    (Prometheus, StatsD, OpenTelemetry spans).
+    """
+    
+    _NULL_TIMER = nullcontext()
+    
+    def timer(self, name: str, **labels):
+        """Context manager that observes its duration in seconds as name"""
+        return self._NULL_TIMER
+    
+    def observe(self, name: str, seconds: float, **labels):
+        pass
+    
+    def increment(self, name: str, amount: int = 1, **labels):
+        pass
+    
+    def add_collector(self, collector):
+        """Register a callable returning {name: value} gauges, read at export time"""
+    
+    def render(self) -> str:
+        return ""
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "started")
+    
+    def __init__(self, metrics: Metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+class PrometheusMetrics(Metrics):
+    """In-process counters and histograms rendered in the Prometheus text format"""
+    
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                       0.1, 0.25, 0.5, 1.0, 2.5)
+    
+    def __init__(self, namespace: str = "api_key", buckets: tuple = None):
+        self.namespace = namespace
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        self._histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+        self._counters = {}  # name -> {labels: value}
+        self._collectors = []
+        self._lock = threading.Lock()
+    
+    def timer(self, name: str, **labels):
+        return _Timer(self, name, labels)
+    
+    def observe(self, name: str, seconds: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+            values[-2] += seconds
+            values[-1] += 1
+    
+    def increment(self, name: str, amount: int = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+    
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+    
+    @staticmethod
+    def _labels(pairs) -> str:
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+    
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                metric = f"{self.namespace}_{name}"
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{metric}{self._labels(key)} {value}")
+            
+            for name, series in sorted(self._histograms.items()):
+                metric = f"{self.namespace}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for key, values in sorted(series.items()):
+                    for bound, count in zip(self.buckets, values):
+                        lines.append(f"{metric}_bucket{self._labels(key + (('le', bound),))} {count}")
+                    lines.append(f"{metric}_bucket{self._labels(key + (('le', '+Inf'),))} {values[-1]}")
+                    lines.append(f"{metric}_sum{self._labels(key)} {values[-2]}")
+                    lines.append(f"{metric}_count{self._labels(key)} {values[-1]}")
+        
+        for collector in self._collectors:
+            for name, value in sorted(collector().items()):
+                metric = f"{self.namespace}_{name}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+# Column order used by every SELECT that is hydrated through _row_to_api_key
+API_KEY_COLUMNS = """id, name, key_hash, user_id, status, created_at, expires_at,
+                     last_used_at, rate_limit, permissions, usage_count"""
 
 class APIKeyManager:
-    def __init__(self, db_path: str = "api_keys.db"):
+    def __init__(self, db_path: str = "api_keys.db", rate_limiter: RateLimiter = None,
+                 hasher: BcryptWorkerPool = None, metrics: Metrics = None):
         self.db_path = db_path
         self.logger = logging.getLogger(__name__)
+        self.metrics = metrics or Metrics()
+        self._db = SQLiteConnectionPool(db_path)
         self._init_database()
-        self._rate_limit_cache = {}  # In production, use Redis
+        # Use SQLiteRateLimiter (or a Redis-backed RateLimiter) when several
+        # worker processes must share one limit
+        self.rate_limiter = rate_limiter or InMemoryRateLimiter()
+        self.key_cache = VerifiedKeyCache()
+        self._revocation_seq = self._latest_revocation_seq()
+        self._next_revocation_poll = 0.0
+        self._revocation_lock = threading.Lock()
+        self.hasher = hasher or BcryptWorkerPool()
+        self.usage_writer = UsageLogWriter(self._db)
+        # Bounds on the legacy migration scan (see _validate_legacy_key)
+        self._legacy_scans = threading.BoundedSemaphore(APIKeyConfig.LEGACY_SCAN_MAX_CONCURRENT)
+        self._legacy_scan_limiter = InMemoryRateLimiter(
+            window_seconds=APIKeyConfig.LEGACY_SCAN_WINDOW_SECONDS, stripes=16)
+        self._legacy_failures = OrderedDict()  # legacy digest -> expires_at monotonic
+        self._legacy_failures_lock = threading.Lock()
+        self.metrics.add_collector(self._flat_stats)
+        atexit.register(self.close)
+    
+    def stats(self) -> Dict[str, Dict]:
+        """Counters from every subsystem, for benchmarks and health checks"""
+        return {
+            "sqlite": self._db.stats(),
+            "key_cache": self.key_cache.stats(),
+            "hasher": self.hasher.stats(),
+            "usage_writer": self.usage_writer.stats(),
+            "rate_limiter": self.rate_limiter.stats(),
+        }
+    
+    def _flat_stats(self) -> Dict[str, float]:
+        """stats() flattened to gauge names such as key_cache_hits"""
+        return {f"{subsystem}_{name}": value
+                for subsystem, values in self.stats().items()
+                for name, value in values.items()}
+    
+    def close(self):
+        """Drain pending usage writes and close pooled connections"""
+        self.usage_writer.close()
+        self.rate_limiter.close()
+        self._legacy_scan_limiter.close()
+        self.hasher.shutdown(wait=False)
+        self._db.close_all()
     
     def _init_database(self):
         """Initialize SQLite database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._db.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # API Keys table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS api_keys (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    key_hash TEXT NOT NULL UNIQUE,
+                    user_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    expires_at TIMESTAMP,
+                    last_used_at TIMESTAMP,
+                    rate_limit INTEGER NOT NULL,
+                    permissions TEXT NOT NULL,
+                    usage_count INTEGER DEFAULT 0,
+                    key_version INTEGER NOT NULL DEFAULT 1,
+                    legacy_digest TEXT
+                )
+            """)
+            self._migrate_api_keys_table(cursor)
+            
+            # Usage logs table for analytics
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS api_usage_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    api_key_id TEXT NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    timestamp TIMESTAMP NOT NULL,
+                    ip_address TEXT,
+                    user_agent TEXT,
+                    response_code INTEGER,
+                    FOREIGN KEY (api_key_id) REFERENCES api_keys (id)
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_usage_logs_key_time
+                ON api_usage_logs (api_key_id, timestamp)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_usage_logs_time
+                ON api_usage_logs (timestamp)
+            """)
+            
+            # Per-minute/hour/day counts maintained by the usage writer
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS api_usage_rollups (
+                    granularity TEXT NOT NULL,
+                    bucket_start TIMESTAMP NOT NULL,
+                    api_key_id TEXT NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    response_code INTEGER NOT NULL,  -- 0 when the log has no code
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (granularity, bucket_start, api_key_id, endpoint, response_code)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_usage_rollups_key
+                ON api_usage_rollups (granularity, api_key_id, bucket_start)
+            """)
+            
+            # Revocation feed: every process evicts these ids from its key cache
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS api_key_revocations (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    api_key_id TEXT NOT NULL,
+                    revoked_at TIMESTAMP NOT NULL
+                )
+            """)
+    
+    def _migrate_api_keys_table(self, cursor):
+        """Add the lookup columns to databases created before key_version existed"""
+        cursor.execute("PRAGMA table_info(api_keys)")
+        columns = {row[1] for row in cursor.fetchall()}
+        
+        # Rows that predate the column are legacy keys, hence DEFAULT 1
+        if "key_version" not in columns:
+            cursor.execute("ALTER TABLE api_keys ADD COLUMN key_version INTEGER NOT NULL DEFAULT 1")
+        if "legacy_digest" not in columns:
+            cursor.execute("ALTER TABLE api_keys ADD COLUMN legacy_digest TEXT")
         
-        # API Keys table
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS api_keys (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                key_hash TEXT NOT NULL UNIQUE,
-                user_id TEXT NOT NULL,
-                status TEXT NOT NULL,
-                created_at TIMESTAMP NOT NULL,
-                expires_at TIMESTAMP,
-                last_used_at TIMESTAMP,
-                rate_limit INTEGER NOT NULL,
-                permissions TEXT NOT NULL,
-                usage_count INTEGER DEFAULT 0
-            )
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_api_keys_legacy_digest
+            ON api_keys (legacy_digest) WHERE legacy_digest IS NOT NULL
         """)
-        
-        # Usage logs table for analytics
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS api_usage_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                api_key_id TEXT NOT NULL,
-                endpoint TEXT NOT NULL,
-                method TEXT NOT NULL,
-                timestamp TIMESTAMP NOT NULL,
-                ip_address TEXT,
-                user_agent TEXT,
-                response_code INTEGER,
-                FOREIGN KEY (api_key_id) REFERENCES api_keys (id)
-            )
+            CREATE INDEX IF NOT EXISTS idx_api_keys_unmigrated
+            ON api_keys (key_version) WHERE legacy_digest IS NULL
         """)
-        
-        conn.commit()
-        conn.close()
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_api_keys_user
+            ON api_keys (user_id)
+        """)
+    
+    @staticmethod
+    def _split_key(key_string: str) -> tuple[Optional[str], str]:
+        """Split 'sk-<id>.<secret>' into (id, secret); legacy keys return (None, key)"""
+        body = key_string[len(APIKeyConfig.PREFIX):]
+        key_id, sep, secret = body.partition(APIKeyConfig.ID_SEPARATOR)
+        if not sep:
+            return None, key_string
+        return key_id, secret
+    
+    @staticmethod
+    def _legacy_digest(key_string: str) -> str:
+        """Indexed lookup digest for a legacy key (the bcrypt hash still verifies it)"""
+        return hashlib.sha256(key_string.encode()).hexdigest()
+    
+    @staticmethod
+    def _row_to_api_key(row) -> APIKey:
+        """Convert an API_KEY_COLUMNS row to an APIKey object"""
+        return APIKey(
+            id=row[0],
+            name=row[1],
+            key_hash=row[2],
+            user_id=row[3],
+            status=APIKeyStatus(row[4]),
+            created_at=datetime.fromisoformat(row[5]),
+            expires_at=datetime.fromisoformat(row[6]) if row[6] else None,
+            last_used_at=datetime.fromisoformat(row[7]) if row[7] else None,
+            rate_limit=row[8],
+            permissions=row[9].split(",") if row[9] else [],
+            usage_count=row[10]
+        )
     
     def generate_api_key(self, 
                         name: str, 
@@ -100,200 +1157,610 @@ class APIKeyManager:
                         rate_limit: int = None,
                         expires_in_days: int = None) -> tuple[str, APIKey]:
         """Generate a new API key"""
-        # Generate random key
-        random_bytes = secrets.token_bytes(APIKeyConfig.KEY_LENGTH)
-        key_string = APIKeyConfig.PREFIX + secrets.token_urlsafe(APIKeyConfig.KEY_LENGTH)
+        key_string, secret, api_key = self._draft_api_key(
+            name, user_id, permissions, rate_limit, expires_in_days)
         
-        # Hash the key for storage
-        key_hash = bcrypt.hashpw(key_string.encode(), bcrypt.gensalt(rounds=APIKeyConfig.HASH_ROUNDS))
+        # Hash the secret for storage
+        api_key.key_hash = self.hasher.hash(secret)
         
-        # Create API key object
+        # Store in database
+        self._store_api_key(api_key)
+        
+        return key_string, api_key
+    
+    def generate_api_keys(self,
+                          count: int,
+                          name: str,
+                          user_id: str,
+                          permissions: List[str] = None,
+                          rate_limit: int = None,
+                          expires_in_days: int = None,
+                          hash_rounds: int = None,
+                          min_hash_rounds: int = None) -> List[tuple[str, APIKey]]:
+        """Generate count keys for one user, named "<name>-1" .. "<name>-<count>".
+        
+        Secrets are hashed in parallel on the hashing pool and all rows are
+        inserted in a single transaction, so either every key is created or
+        none is. Throughput is bounded by bcrypt: roughly
+        count * cost / HASH_POOL_WORKERS. hash_rounds can lower the cost for
+        large batches; the secrets are 256-bit random values, so bcrypt's work
+        factor adds little protection against guessing them.
+        
+        hash_rounds may not go below MIN_BULK_HASH_ROUNDS; seeding and
+        benchmark scripts can pass a lower min_hash_rounds for throwaway keys.
+        """
+        if not 0 < count <= APIKeyConfig.MAX_BULK_KEYS:
+            raise ValueError(f"count must be between 1 and {APIKeyConfig.MAX_BULK_KEYS}")
+        min_rounds = APIKeyConfig.MIN_BULK_HASH_ROUNDS if min_hash_rounds is None else min_hash_rounds
+        if hash_rounds is not None and (
+                type(hash_rounds) is not int
+                or not min_rounds <= hash_rounds <= APIKeyConfig.HASH_ROUNDS):
+            raise ValueError(f"hash_rounds must be an integer between "
+                             f"{min_rounds} and {APIKeyConfig.HASH_ROUNDS}")
+        
+        drafts = [
+            self._draft_api_key(f"{name}-{i + 1}", user_id, permissions, rate_limit, expires_in_days)
+            for i in range(count)
+        ]
+        hashes = self.hasher.hash_many([secret for _, secret, _ in drafts], hash_rounds)
+        for (_, _, api_key), key_hash in zip(drafts, hashes):
+            api_key.key_hash = key_hash
+        
+        self._store_api_keys([api_key for _, _, api_key in drafts])
+        return [(key_string, api_key) for key_string, _, api_key in drafts]
+    
+    def _draft_api_key(self, name: str, user_id: str, permissions: List[str] = None,
+                       rate_limit: int = None, expires_in_days: int = None) -> tuple[str, str, APIKey]:
+        """Create key string, secret and an APIKey whose key_hash is still empty"""
+        # Generate random key: the id is public and indexed, only the secret is hashed
+        key_id = secrets.token_urlsafe(16)
+        secret = secrets.token_urlsafe(APIKeyConfig.KEY_LENGTH)
+        key_string = APIKeyConfig.PREFIX + key_id + APIKeyConfig.ID_SEPARATOR + secret
+        
+        now = datetime.utcnow()
         api_key = APIKey(
-            id=secrets.token_urlsafe(16),
+            id=key_id,
             name=name,
-            key_hash=key_hash.decode(),
+            key_hash="",
             user_id=user_id,
             status=APIKeyStatus.ACTIVE,
-            created_at=datetime.utcnow(),
-            expires_at=datetime.utcnow() + timedelta(days=expires_in_days or APIKeyConfig.DEFAULT_EXPIRY_DAYS),
+            created_at=now,
+            expires_at=now + timedelta(days=expires_in_days or APIKeyConfig.DEFAULT_EXPIRY_DAYS),
             last_used_at=None,
             rate_limit=rate_limit or APIKeyConfig.DEFAULT_RATE_LIMIT,
             permissions=permissions or ["read"],
             usage_count=0
         )
-        
-        # Store in database
-        self._store_api_key(api_key)
-        
-        return key_string, api_key
+        return key_string, secret, api_key
     
     def _store_api_key(self, api_key: APIKey):
         """Store API key in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self._store_api_keys([api_key])
+    
+    def _store_api_keys(self, api_keys: List[APIKey]):
+        """Store API keys in database in one transaction"""
+        with self._db.transaction() as conn:
+            conn.executemany("""
+                INSERT INTO api_keys 
+                (id, name, key_hash, user_id, status, created_at, expires_at, 
+                 last_used_at, rate_limit, permissions, usage_count, key_version)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                api_key.id, api_key.name, api_key.key_hash, api_key.user_id,
+                api_key.status.value, api_key.created_at, api_key.expires_at,
+                api_key.last_used_at, api_key.rate_limit, 
+                ",".join(api_key.permissions), api_key.usage_count,
+                ID_SECRET_KEY_VERSION
+            ) for api_key in api_keys])
+    
+    def validate_api_key(self, key_string: str, client: str = None) -> Optional[APIKey]:
+        """Validate an API key and return APIKey object if valid.
         
-        cursor.execute("""
-            INSERT INTO api_keys 
-            (id, name, key_hash, user_id, status, created_at, expires_at, 
-             last_used_at, rate_limit, permissions, usage_count)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            api_key.id, api_key.name, api_key.key_hash, api_key.user_id,
-            api_key.status.value, api_key.created_at, api_key.expires_at,
-            api_key.last_used_at, api_key.rate_limit, 
-            ",".join(api_key.permissions), api_key.usage_count
-        ))
-        
-        conn.commit()
-        conn.close()
-    
-    def validate_api_key(self, key_string: str) -> Optional[APIKey]:
-        """Validate an API key and return APIKey object if valid"""
+        client (e.g. the remote address) only rate limits legacy key scans.
+        """
         if not key_string.startswith(APIKeyConfig.PREFIX):
             return None
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Repeat requests are served from memory without SQLite or bcrypt
+        with self.metrics.timer("phase_seconds", phase="cache"):
+            self.poll_revocations()
+            api_key = self.key_cache.get(key_string)
+        if api_key is not None:
+            self.metrics.increment("validations_total", result="cache_hit")
+            self._update_last_used(api_key.id)
+            return api_key
         
-        # Get all active keys (in production, add indexing)
-        cursor.execute("""
-            SELECT * FROM api_keys 
-            WHERE status = ? AND (expires_at IS NULL OR expires_at > ?)
-        """, (APIKeyStatus.ACTIVE.value, datetime.utcnow()))
+        key_id, secret = self._split_key(key_string)
+        if key_id is None:
+            with self.metrics.timer("phase_seconds", phase="legacy"):
+                api_key = self._validate_legacy_key(key_string, client)
+            if api_key is not None:
+                self.key_cache.put(key_string, api_key)
+            self.metrics.increment("validations_total", result="legacy" if api_key else "rejected")
+            return api_key
         
-        rows = cursor.fetchall()
-        conn.close()
+        # Single primary-key lookup, then at most one bcrypt check
+        with self.metrics.timer("phase_seconds", phase="db"):
+            row = self._fetch_active_key(key_id)
+        if row is not None:
+            with self.metrics.timer("phase_seconds", phase="bcrypt"):
+                verified = self.hasher.verify(secret, row[2])
+        if row is None or not verified:
+            self.metrics.increment("validations_total", result="rejected")
+            return None
+        self.metrics.increment("validations_total", result="verified")
+        return self._accept_key(key_string, row)
+    
+    async def validate_api_key_async(self, key_string: str, client: str = None,
+                                     fetch_row: Callable[[str], Awaitable] = None) -> Optional[APIKey]:
+        """validate_api_key for async callers: bcrypt is awaited on the hashing pool.
         
-        # Check each key hash
-        for row in rows:
-            stored_hash = row[2].encode()  # key_hash column
-            if bcrypt.checkpw(key_string.encode(), stored_hash):
-                # Convert row to APIKey object
-                api_key = APIKey(
-                    id=row[0],
-                    name=row[1],
-                    key_hash=row[2],
-                    user_id=row[3],
-                    status=APIKeyStatus(row[4]),
-                    created_at=datetime.fromisoformat(row[5]),
-                    expires_at=datetime.fromisoformat(row[6]) if row[6] else None,
-                    last_used_at=datetime.fromisoformat(row[7]) if row[7] else None,
-                    rate_limit=row[8],
-                    permissions=row[9].split(",") if row[9] else [],
-                    usage_count=row[10]
-                )
-                
-                # Update last used timestamp
-                self._update_last_used(api_key.id)
-                return api_key
+        fetch_row is an async key_id -> API_KEY_COLUMNS row lookup (e.g. over
+        aiosqlite); by default the pooled SQLite connection is read directly.
+        """
+        if not key_string.startswith(APIKeyConfig.PREFIX):
+            return None
+        
+        with self.metrics.timer("phase_seconds", phase="cache"):
+            if self.revocation_poll_due():
+                await asyncio.to_thread(self.poll_revocations)
+            api_key = self.key_cache.get(key_string)
+        if api_key is not None:
+            self.metrics.increment("validations_total", result="cache_hit")
+            self.usage_writer.touch_key(api_key.id, datetime.utcnow(), block=False)
+            return api_key
         
-        return None
+        key_id, secret = self._split_key(key_string)
+        if key_id is None:
+            # Rare migration path; run the whole thing off the event loop
+            with self.metrics.timer("phase_seconds", phase="legacy"):
+                api_key = await asyncio.to_thread(self._validate_legacy_key, key_string, client)
+            if api_key is not None:
+                self.key_cache.put(key_string, api_key)
+            self.metrics.increment("validations_total", result="legacy" if api_key else "rejected")
+            return api_key
+        
+        # Indexed WAL read; readers are never blocked by usage writes
+        with self.metrics.timer("phase_seconds", phase="db"):
+            row = await fetch_row(key_id) if fetch_row else self._fetch_active_key(key_id)
+        if row is not None:
+            with self.metrics.timer("phase_seconds", phase="bcrypt"):
+                verified = await self.hasher.verify_async(secret, row[2])
+        if row is None or not verified:
+            self.metrics.increment("validations_total", result="rejected")
+            return None
+        self.metrics.increment("validations_total", result="verified")
+        return self._accept_key(key_string, row, block=False)
     
-    def check_rate_limit(self, api_key: APIKey) -> tuple[bool, RateLimitInfo]:
-        """Check if API key has exceeded rate limit"""
-        key_id = api_key.id
-        now = datetime.utcnow()
-        window_start = now.replace(minute=0, second=0, microsecond=0)  # Hourly window
+    def _fetch_active_key(self, key_id: str):
+        with self._db.connection() as conn:
+            return conn.execute(f"""
+                SELECT {API_KEY_COLUMNS} FROM api_keys
+                WHERE id = ? AND key_version = ? AND status = ?
+                  AND (expires_at IS NULL OR expires_at > ?)
+            """, (key_id, ID_SECRET_KEY_VERSION, APIKeyStatus.ACTIVE.value, datetime.utcnow())).fetchone()
+    
+    def _accept_key(self, key_string: str, row, block: bool = True) -> APIKey:
+        """Hydrate a verified row, cache it and record the use"""
+        api_key = self._row_to_api_key(row)
+        self.key_cache.put(key_string, api_key)
+        
+        # Update last used timestamp
+        self._update_last_used(api_key.id, block)
+        return api_key
+    
+    def _validate_legacy_key(self, key_string: str, client: str = None) -> Optional[APIKey]:
+        """Validate a pre-'sk-<id>.<secret>' key.
+        
+        Legacy keys are found through legacy_digest once they have been seen;
+        the first successful validation of each one falls back to scanning the
+        not-yet-migrated legacy rows and then records the digest, so every
+        later request is a single indexed lookup.
         
-        if key_id not in self._rate_limit_cache:
-            self._rate_limit_cache[key_id] = RateLimitInfo(0, window_start, api_key.rate_limit)
+        A scan costs one bcrypt check per unmigrated row, and any "sk-" string
+        without an id reaches it, so scans are bounded: digests that failed
+        one are remembered for LEGACY_FAILURE_TTL_SECONDS, each client gets
+        LEGACY_SCANS_PER_CLIENT per window, at most LEGACY_SCAN_MAX_CONCURRENT
+        run at once, and bcrypt runs after the connection is returned.
+        """
+        if not APIKeyConfig.ALLOW_LEGACY_KEYS:
+            return None
         
-        rate_info = self._rate_limit_cache[key_id]
+        digest = self._legacy_digest(key_string)
         
-        # Reset if new window
-        if rate_info.window_start < window_start:
-            rate_info.requests_made = 0
-            rate_info.window_start = window_start
+        with self._db.connection() as conn:
+            row = conn.execute(f"""
+                SELECT {API_KEY_COLUMNS} FROM api_keys
+                WHERE legacy_digest = ? AND status = ?
+                  AND (expires_at IS NULL OR expires_at > ?)
+            """, (digest, APIKeyStatus.ACTIVE.value, datetime.utcnow())).fetchone()
         
-        # Check limit
-        if rate_info.requests_made >= rate_info.limit:
-            return False, rate_info
+        if row is not None:
+            if not self.hasher.verify(key_string, row[2]):
+                return None
+        else:
+            row = self._scan_legacy_keys(key_string, digest, client)
+            if row is None:
+                return None
         
-        # Increment counter
-        rate_info.requests_made += 1
-        return True, rate_info
+        api_key = self._row_to_api_key(row)
+        self._update_last_used(api_key.id)
+        return api_key
     
-    def _update_last_used(self, api_key_id: str):
-        """Update last used timestamp and increment usage count"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _scan_legacy_keys(self, key_string: str, digest: str, client: str = None):
+        """Migration path: bcrypt-check the legacy rows without a digest yet"""
+        if self._legacy_failed(digest):
+            return None
+        allowed, _ = self._legacy_scan_limiter.hit(client or "unknown", APIKeyConfig.LEGACY_SCANS_PER_CLIENT)
+        if not allowed or not self._legacy_scans.acquire(blocking=False):
+            self.metrics.increment("legacy_scans_throttled_total")
+            return None
         
-        cursor.execute("""
-            UPDATE api_keys 
-            SET last_used_at = ?, usage_count = usage_count + 1
-            WHERE id = ?
-        """, (datetime.utcnow(), api_key_id))
+        try:
+            with self._db.connection() as conn:
+                candidates = conn.execute(f"""
+                    SELECT {API_KEY_COLUMNS} FROM api_keys
+                    WHERE key_version = ? AND legacy_digest IS NULL AND status = ?
+                      AND (expires_at IS NULL OR expires_at > ?)
+                """, (LEGACY_KEY_VERSION, APIKeyStatus.ACTIVE.value, datetime.utcnow())).fetchall()
+            
+            row = next(
+                (candidate for candidate in candidates
+                 if self.hasher.verify(key_string, candidate[2])),
+                None
+            )
+        finally:
+            self._legacy_scans.release()
+        
+        if row is None:
+            self._remember_legacy_failure(digest)
+            return None
         
-        conn.commit()
-        conn.close()
+        with self._db.transaction() as conn:
+            conn.execute("""
+                UPDATE api_keys SET legacy_digest = ? WHERE id = ? AND legacy_digest IS NULL
+            """, (digest, row[0]))
+        self.logger.info("Migrated legacy API key %s to indexed lookup", row[0])
+        return row
+    
+    def _legacy_failed(self, digest: str) -> bool:
+        with self._legacy_failures_lock:
+            expires_at = self._legacy_failures.get(digest)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._legacy_failures[digest]
+                return False
+            return True
+    
+    def _remember_legacy_failure(self, digest: str):
+        with self._legacy_failures_lock:
+            self._legacy_failures.pop(digest, None)
+            self._legacy_failures[digest] = time.monotonic() + APIKeyConfig.LEGACY_FAILURE_TTL_SECONDS
+            while len(self._legacy_failures) > APIKeyConfig.LEGACY_FAILURE_CACHE_SIZE:
+                self._legacy_failures.popitem(last=False)
+    
+    def count_unmigrated_legacy_keys(self) -> int:
+        """Number of active legacy keys that still need a scan on first use"""
+        with self._db.connection() as conn:
+            return conn.execute("""
+                SELECT COUNT(*) FROM api_keys
+                WHERE key_version = ? AND legacy_digest IS NULL AND status = ?
+            """, (LEGACY_KEY_VERSION, APIKeyStatus.ACTIVE.value)).fetchone()[0]
+    
+    def check_rate_limit(self, api_key: APIKey) -> tuple[bool, RateLimitInfo]:
+        """Check if API key has exceeded rate limit"""
+        with self.metrics.timer("phase_seconds", phase="rate_limit"):
+            allowed, rate_info = self.rate_limiter.hit(api_key.id, api_key.rate_limit)
+        if not allowed:
+            self.metrics.increment("rate_limited_total")
+        return allowed, rate_info
+    
+    def _update_last_used(self, api_key_id: str, block: bool = True):
+        """Update last used timestamp and increment usage count (batched in the background)"""
+        self.usage_writer.touch_key(api_key_id, datetime.utcnow(), block)
+    
+    def _latest_revocation_seq(self) -> int:
+        with self._db.connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM api_key_revocations").fetchone()[0]
+    
+    def revocation_poll_due(self) -> bool:
+        """Whether poll_revocations would read SQLite (async callers run it in a thread then)"""
+        return time.monotonic() >= self._next_revocation_poll
+    
+    def poll_revocations(self):
+        """Evict keys revoked by other processes; reads SQLite at most every REVOCATION_POLL_SECONDS"""
+        if not self.revocation_poll_due():
+            return
+        with self._revocation_lock:
+            now = time.monotonic()
+            if now < self._next_revocation_poll:
+                return
+            self._next_revocation_poll = now + APIKeyConfig.REVOCATION_POLL_SECONDS
+            with self._db.connection() as conn:
+                rows = conn.execute("""
+                    SELECT seq, api_key_id FROM api_key_revocations WHERE seq > ? ORDER BY seq
+                """, (self._revocation_seq,)).fetchall()
+            for seq, api_key_id in rows:
+                self.key_cache.evict_key_id(api_key_id)
+                self._revocation_seq = seq
+    
+    def _record_revocations(self, conn, api_key_ids: List[str]):
+        """Publish revocations to other processes; caller holds a write transaction"""
+        now = datetime.utcnow()
+        conn.executemany("""
+            INSERT INTO api_key_revocations (api_key_id, revoked_at) VALUES (?, ?)
+        """, [(api_key_id, now) for api_key_id in api_key_ids])
+        # Entries only matter while a cached key could still be served
+        conn.execute("""
+            DELETE FROM api_key_revocations WHERE revoked_at < ?
+        """, (now - timedelta(seconds=2 * APIKeyConfig.CACHE_TTL_SECONDS),))
     
     def revoke_api_key(self, api_key_id: str) -> bool:
         """Revoke an API key"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._db.transaction() as conn:
+            cursor = conn.execute("""
+                UPDATE api_keys SET status = ? WHERE id = ?
+            """, (APIKeyStatus.REVOKED.value, api_key_id))
+            success = cursor.rowcount > 0
+            if success:
+                self._record_revocations(conn, [api_key_id])
         
-        cursor.execute("""
-            UPDATE api_keys SET status = ? WHERE id = ?
-        """, (APIKeyStatus.REVOKED.value, api_key_id))
+        # Revocation must take effect immediately, not when the cache entry ages out
+        self.key_cache.evict_key_id(api_key_id)
+        return success
+    
+    def revoke_api_keys(self, api_key_ids: List[str]) -> int:
+        """Revoke a list of API keys in one statement; returns how many were revoked"""
+        with self._db.transaction() as conn:
+            revoked = conn.execute("""
+                UPDATE api_keys SET status = ?
+                WHERE id IN (SELECT value FROM json_each(?)) AND status != ?
+                RETURNING id
+            """, (APIKeyStatus.REVOKED.value, json.dumps(list(api_key_ids)),
+                  APIKeyStatus.REVOKED.value)).fetchall()
+            self._record_revocations(conn, [api_key_id for (api_key_id,) in revoked])
         
-        success = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        for (api_key_id,) in revoked:
+            self.key_cache.evict_key_id(api_key_id)
+        return len(revoked)
+    
+    def revoke_user_keys(self, user_id: str) -> int:
+        """Revoke every key belonging to user_id; returns how many were revoked"""
+        with self._db.transaction() as conn:
+            revoked = conn.execute("""
+                UPDATE api_keys SET status = ?
+                WHERE user_id = ? AND status != ?
+                RETURNING id
+            """, (APIKeyStatus.REVOKED.value, user_id, APIKeyStatus.REVOKED.value)).fetchall()
+            self._record_revocations(conn, [api_key_id for (api_key_id,) in revoked])
         
-        return success
+        for (api_key_id,) in revoked:
+            self.key_cache.evict_key_id(api_key_id)
+        return len(revoked)
     
     def log_api_usage(self, api_key_id: str, endpoint: str, method: str, 
                      ip_address: str = None, user_agent: str = None, 
                      response_code: int = 200):
-        """Log API usage for analytics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Log API usage for analytics (batched in the background)"""
+        with self.metrics.timer("phase_seconds", phase="usage_log"):
+            queued = self.usage_writer.log_usage(api_key_id, endpoint, method, datetime.utcnow(),
+                                                 ip_address, user_agent, response_code)
+        if not queued:
+            self.metrics.increment("usage_events_dropped_total")
+    
+    def get_usage(self, start: datetime, end: datetime, granularity: str = "hour",
+                  api_key_id: str = None, endpoint: str = None,
+                  group_by: List[str] = None) -> List[Dict]:
+        """Usage counts for the buckets overlapping [start, end), read from the rollups.
         
-        cursor.execute("""
-            INSERT INTO api_usage_logs 
-            (api_key_id, endpoint, method, timestamp, ip_address, user_agent, response_code)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (api_key_id, endpoint, method, datetime.utcnow(), 
-              ip_address, user_agent, response_code))
-        
-        conn.commit()
-        conn.close()
+        group_by picks any of bucket_start, api_key_id, endpoint and
+        response_code (default: bucket_start); the remaining dimensions are
+        summed. Whole buckets are counted at the range edges, so pick a finer
+        granularity when start/end do not fall on bucket boundaries.
+        """
+        if granularity not in ROLLUP_BUCKET_FORMATS:
+            raise ValueError(f"granularity must be one of {list(ROLLUP_BUCKET_FORMATS)}")
+        group_by = list(group_by or ["bucket_start"])
+        unknown = set(group_by) - set(USAGE_GROUP_COLUMNS)
+        if unknown:
+            raise ValueError(f"Cannot group usage by {sorted(unknown)}")
+        
+        bucket_format = ROLLUP_BUCKET_FORMATS[granularity]
+        conditions = ["granularity = ?", "bucket_start >= ?", "bucket_start < ?"]
+        params = [granularity, start.strftime(bucket_format), end.strftime("%Y-%m-%d %H:%M:%S")]
+        if api_key_id is not None:
+            conditions.append("api_key_id = ?")
+            params.append(api_key_id)
+        if endpoint is not None:
+            conditions.append("endpoint = ?")
+            params.append(endpoint)
+        
+        columns = ", ".join(group_by)
+        with self._db.connection() as conn:
+            rows = conn.execute(f"""
+                SELECT {columns}, SUM(count) FROM api_usage_rollups
+                WHERE {" AND ".join(conditions)}
+                GROUP BY {columns}
+                ORDER BY {columns}
+            """, params).fetchall()
+        
+        results = []
+        for row in rows:
+            result = dict(zip(group_by, row))
+            if "bucket_start" in result:
+                result["bucket_start"] = datetime.fromisoformat(result["bucket_start"])
+            result["count"] = row[-1]
+            results.append(result)
+        return results
+    
+    def rebuild_usage_rollups(self, minute_rollup_retention_days: int = None):
+        """Recompute rollups from the raw logs (e.g. for logs written before rollups existed).
+        
+        Logs are re-aggregated USAGE_REBUILD_SLICE_HOURS at a time, one
+        transaction per slice, so the usage writer and SQLiteRateLimiter are
+        never blocked for long. Minute rollups are only rebuilt within their
+        retention horizon and day rollups are summed from the hour rollups.
+        Older rollups outlive prune_usage_logs and are left alone; the oldest
+        bucket may have lost logs to pruning, so it keeps the larger of the
+        stored and rebuilt counts.
+        """
+        self.usage_writer.flush()
+        with self._db.connection() as conn:
+            oldest, newest = conn.execute(
+                "SELECT MIN(timestamp), MAX(timestamp) FROM api_usage_logs").fetchone()
+        if oldest is None:
+            return
+        oldest, newest = datetime.fromisoformat(oldest), datetime.fromisoformat(newest)
+        minute_horizon = (datetime.utcnow() - timedelta(
+            days=minute_rollup_retention_days or APIKeyConfig.MINUTE_ROLLUP_RETENTION_DAYS
+        )).replace(second=0, microsecond=0)
+        first_buckets = {granularity: oldest.strftime(bucket_format)
+                         for granularity, bucket_format in ROLLUP_BUCKET_FORMATS.items()}
+        
+        # Slices start on the hour, so no minute or hour bucket spans two of them
+        step = timedelta(hours=APIKeyConfig.USAGE_REBUILD_SLICE_HOURS)
+        slice_start = oldest.replace(minute=0, second=0, microsecond=0)
+        while slice_start <= newest:
+            slice_end = slice_start + step
+            with self._db.transaction() as conn:
+                self._rebuild_rollup_slice(conn, "hour", slice_start, slice_end, first_buckets["hour"])
+                if slice_end > minute_horizon:
+                    self._rebuild_rollup_slice(conn, "minute", max(slice_start, minute_horizon),
+                                               slice_end, first_buckets["minute"])
+            slice_start = slice_end
+        
+        day = oldest.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day <= newest:
+            bucket = day.strftime(ROLLUP_BUCKET_FORMATS["day"])
+            with self._db.transaction() as conn:
+                conn.execute("""
+                    DELETE FROM api_usage_rollups
+                    WHERE granularity = 'day' AND bucket_start = ? AND bucket_start > ?
+                """, (bucket, first_buckets["day"]))
+                conn.execute("""
+                    INSERT INTO api_usage_rollups
+                    (granularity, bucket_start, api_key_id, endpoint, response_code, count)
+                    SELECT 'day', ?, api_key_id, endpoint, response_code, SUM(count)
+                    FROM api_usage_rollups
+                    WHERE granularity = 'hour' AND bucket_start >= ? AND bucket_start < ?
+                    GROUP BY api_key_id, endpoint, response_code
+                    ON CONFLICT (granularity, bucket_start, api_key_id, endpoint, response_code)
+                    DO UPDATE SET count = MAX(count, excluded.count)
+                """, (bucket, bucket, (day + timedelta(days=1)).strftime(ROLLUP_BUCKET_FORMATS["day"])))
+            day += timedelta(days=1)
+    
+    @staticmethod
+    def _rebuild_rollup_slice(conn: sqlite3.Connection, granularity: str, start: datetime,
+                              end: datetime, first_bucket: str):
+        """Replace one granularity's rollups for [start, end) with counts from the logs"""
+        bucket_format = ROLLUP_BUCKET_FORMATS[granularity]
+        conn.execute("""
+            DELETE FROM api_usage_rollups
+            WHERE granularity = ? AND bucket_start >= ? AND bucket_start < ? AND bucket_start > ?
+        """, (granularity, start.strftime(bucket_format), end.strftime(bucket_format), first_bucket))
+        conn.execute("""
+            INSERT INTO api_usage_rollups
+            (granularity, bucket_start, api_key_id, endpoint, response_code, count)
+            SELECT ?, strftime(?, timestamp), api_key_id, endpoint,
+                   COALESCE(response_code, 0), COUNT(*)
+            FROM api_usage_logs
+            WHERE timestamp >= ? AND timestamp < ?
+            GROUP BY 2, api_key_id, endpoint, 5
+            ON CONFLICT (granularity, bucket_start, api_key_id, endpoint, response_code)
+            DO UPDATE SET count = MAX(count, excluded.count)
+        """, (granularity, bucket_format, start, end))
+    
+    def prune_usage_logs(self, retention_days: int = None,
+                         minute_rollup_retention_days: int = None) -> int:
+        """Delete raw usage logs and minute rollups older than their retention horizon.
+        
+        Raw rows are deleted in batches of USAGE_PRUNE_BATCH_SIZE so request
+        writes are never blocked for long. Returns the number of raw rows removed.
+        """
+        now = datetime.utcnow()
+        log_cutoff = now - timedelta(days=retention_days or APIKeyConfig.USAGE_LOG_RETENTION_DAYS)
+        rollup_cutoff = now - timedelta(
+            days=minute_rollup_retention_days or APIKeyConfig.MINUTE_ROLLUP_RETENTION_DAYS)
+        
+        deleted = 0
+        while True:
+            with self._db.transaction() as conn:
+                cursor = conn.execute("""
+                    DELETE FROM api_usage_logs WHERE id IN (
+                        SELECT id FROM api_usage_logs WHERE timestamp < ? LIMIT ?
+                    )
+                """, (log_cutoff, APIKeyConfig.USAGE_PRUNE_BATCH_SIZE))
+                deleted += cursor.rowcount
+            if cursor.rowcount < APIKeyConfig.USAGE_PRUNE_BATCH_SIZE:
+                break
+        
+        with self._db.transaction() as conn:
+            conn.execute("""
+                DELETE FROM api_usage_rollups WHERE granularity = 'minute' AND bucket_start < ?
+            """, (rollup_cutoff.strftime(ROLLUP_BUCKET_FORMATS["minute"]),))
+        return deleted
 
 # Flask/FastAPI Integration
 from flask import Flask, request, jsonify, g
 
 app = Flask(__name__)
-api_manager = APIKeyManager()
+# Built on first use, so importing this module (e.g. from the FastAPI
+# integration) does not start a second manager on api_keys.db
+api_manager: Optional[APIKeyManager] = None
+_api_manager_lock = threading.Lock()
+
+def get_api_manager() -> APIKeyManager:
+    global api_manager
+    if api_manager is None:
+        with _api_manager_lock:
+            if api_manager is None:
+                # Counters in the shared database file give every gunicorn worker one limit
+                api_manager = APIKeyManager(
+                    rate_limiter=SQLiteRateLimiter("api_keys.db"),
+                    metrics=PrometheusMetrics() if APIKeyConfig.METRICS_ENABLED else Metrics()
+                )
+    return api_manager
 
 def require_api_key(permissions_required: List[str] = None):
     """Decorator to require API key authentication"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
+            api_manager = get_api_manager()
+            metrics = api_manager.metrics
+            started = time.perf_counter()
+            
+            def reject(reason, *response):
+                metrics.increment("auth_rejections_total", reason=reason)
+                metrics.observe("auth_seconds", time.perf_counter() - started)
+                return response
+            
             # Get API key from header
             auth_header = request.headers.get('Authorization')
             if not auth_header or not auth_header.startswith('Bearer '):
-                return jsonify({'error': 'Missing or invalid Authorization header'}), 401
+                return reject('missing_header', jsonify({'error': 'Missing or invalid Authorization header'}), 401)
             
             api_key_string = auth_header.split(' ')[1]
             
             # Validate API key
-            api_key = api_manager.validate_api_key(api_key_string)
+            api_key = api_manager.validate_api_key(api_key_string, request.remote_addr)
             if not api_key:
-                return jsonify({'error': 'Invalid API key'}), 401
+                return reject('invalid_key', jsonify({'error': 'Invalid API key'}), 401)
             
             # Check permissions
             if permissions_required:
                 if not any(perm in api_key.permissions for perm in permissions_required):
-                    return jsonify({'error': 'Insufficient permissions'}), 403
+                    return reject('forbidden', jsonify({'error': 'Insufficient permissions'}), 403)
             
             # Check rate limit
             allowed, rate_info = api_manager.check_rate_limit(api_key)
             if not allowed:
-                return jsonify({
+                retry_after = math.ceil(rate_info.retry_after)
+                return reject('rate_limited', jsonify({
                     'error': 'Rate limit exceeded',
-                    'retry_after': 3600  # seconds until next window
-                }), 429
+                    'retry_after': retry_after
+                }), 429, {'Retry-After': str(retry_after)})
             
             # Log usage
             api_manager.log_api_usage(
@@ -306,12 +1773,21 @@ def require_api_key(permissions_required: List[str] = None):
             
             # Store API key in request context
             g.api_key = api_key
-            g.rate_limit_remaining = rate_info.limit - rate_info.requests_made
+            g.rate_limit_remaining = max(0, rate_info.limit - rate_info.requests_made)
             
+            # Auth overhead only; the view's own time is not included
+            metrics.observe("auth_seconds", time.perf_counter() - started)
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (set API_KEY_METRICS=1); keep it off public networks"""
+    if not APIKeyConfig.METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return get_api_manager().metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
 # Example API endpoints
 @app.route('/api/data', methods=['GET'])
 @require_api_key(['read', 'data'])
@@ -328,7 +1804,7 @@ def get_data():
 def create_api_key():
     """Create new API key (admin only)"""
     data = request.json
-    key_string, api_key = api_manager.generate_api_key(
+    key_string, api_key = get_api_manager().generate_api_key(
         name=data['name'],
         user_id=data['user_id'],
         permissions=data.get('permissions', ['read']),
@@ -343,6 +1819,58 @@ def create_api_key():
         'expires_at': api_key.expires_at.isoformat() if api_key.expires_at else None
     })
 
+@app.route('/api/admin/keys/bulk', methods=['POST'])
+@require_api_key(['admin'])
+def create_api_keys_bulk():
+    """Create many API keys for one user in a single transaction (admin only)"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    missing = [field for field in ('count', 'name', 'user_id') if field not in data]
+    if missing:
+        return jsonify({'error': f"Missing fields: {', '.join(missing)}"}), 400
+    if type(data['count']) is not int:
+        return jsonify({'error': 'count must be an integer'}), 400
+    
+    try:
+        generated = get_api_manager().generate_api_keys(
+            count=data['count'],
+            name=data['name'],
+            user_id=data['user_id'],
+            permissions=data.get('permissions', ['read']),
+            rate_limit=data.get('rate_limit'),
+            expires_in_days=data.get('expires_in_days'),
+            hash_rounds=data.get('hash_rounds')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'keys': [{
+        'key': key_string,  # Only return once!
+        'id': api_key.id,
+        'name': api_key.name,
+        'expires_at': api_key.expires_at.isoformat() if api_key.expires_at else None
+    } for key_string, api_key in generated]})
+
+@app.route('/api/admin/keys/revoke', methods=['POST'])
+@require_api_key(['admin'])
+def revoke_api_keys_bulk():
+    """Revoke keys by a list of ids or every key of a user (admin only)"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    if data.get('ids'):
+        ids = data['ids']
+        if not isinstance(ids, list) or not all(isinstance(api_key_id, str) for api_key_id in ids):
+            return jsonify({'error': 'ids must be a list of key ids'}), 400
+        revoked = get_api_manager().revoke_api_keys(ids)
+    elif data.get('user_id'):
+        revoked = get_api_manager().revoke_user_keys(data['user_id'])
+    else:
+        return jsonify({'error': 'Provide ids or user_id'}), 400
+    
+    return jsonify({'revoked': revoked})
+
 if __name__ == '__main__':
     # Example usage
     manager = APIKeyManager()
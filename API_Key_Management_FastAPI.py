@@ -0,0 +1,212 @@
+# API Key Management System - FastAPI/ASGI Integration
+#
+# Async counterpart of the Flask require_api_key decorator in
+# API_Key_Management.py. Key rows are read through aiosqlite, bcrypt runs on
+# the manager's hashing pool and usage logging is handed to the background
+# writer without waiting, so the event loop never blocks on auth work.
+#
+#   uvicorn API_Key_Management_FastAPI:app --workers 1
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Optional
+
+import aiosqlite
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel
+
+from API_Key_Management import (
+    API_KEY_COLUMNS,
+    ID_SECRET_KEY_VERSION,
+    APIKey,
+    APIKeyConfig,
+    APIKeyManager,
+    APIKeyStatus,
+    InMemoryRateLimiter,
+    Metrics,
+    PrometheusMetrics,
+    SQLiteRateLimiter,
+)
+
+class AsyncKeyStore:
+    """Small pool of aiosqlite connections for the key lookups on the auth path"""
+
+    def __init__(self, db_path: str, pool_size: int = 4):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._connections = []
+
+    async def open(self):
+        for _ in range(self.pool_size):
+            conn = await aiosqlite.connect(self.db_path, timeout=APIKeyConfig.SQLITE_BUSY_TIMEOUT)
+            await conn.execute("PRAGMA journal_mode=WAL")
+            await conn.execute(f"PRAGMA synchronous={APIKeyConfig.SQLITE_SYNCHRONOUS}")
+            self._connections.append(conn)
+            self._idle.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
+
+    async def fetch_active_key(self, key_id: str):
+        conn = await self._idle.get()
+        try:
+            async with conn.execute(f"""
+                SELECT {API_KEY_COLUMNS} FROM api_keys
+                WHERE id = ? AND key_version = ? AND status = ?
+                  AND (expires_at IS NULL OR expires_at > ?)
+            """, (key_id, ID_SECRET_KEY_VERSION, APIKeyStatus.ACTIVE.value,
+                  datetime.utcnow())) as cursor:
+                return await cursor.fetchone()
+        finally:
+            self._idle.put_nowait(conn)
+
+class AsyncAPIKeyAuth:
+    """FastAPI dependency factory mirroring require_api_key for an APIKeyManager"""
+
+    def __init__(self, manager: APIKeyManager, pool_size: int = 4):
+        self.manager = manager
+        self.store = AsyncKeyStore(manager.db_path, pool_size)
+        self.bearer = HTTPBearer(auto_error=False)
+
+    async def startup(self):
+        await self.store.open()
+
+    async def shutdown(self):
+        await self.store.close()
+        await asyncio.to_thread(self.manager.close)
+
+    async def validate(self, key_string: str, client: str = None) -> Optional[APIKey]:
+        """Async validate_api_key with the key row read through aiosqlite"""
+        return await self.manager.validate_api_key_async(key_string, client, self.store.fetch_active_key)
+
+    def require(self, permissions_required: List[str] = None):
+        """Dependency that authenticates, authorizes, rate limits and logs a request"""
+        async def dependency(
+            request: Request,
+            credentials: Optional[HTTPAuthorizationCredentials] = Depends(self.bearer)
+        ) -> APIKey:
+            metrics = self.manager.metrics
+            started = time.perf_counter()
+
+            def reject(reason: str, status_code: int, detail, headers: dict = None) -> HTTPException:
+                metrics.increment("auth_rejections_total", reason=reason)
+                metrics.observe("auth_seconds", time.perf_counter() - started)
+                return HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+            if credentials is None:
+                raise reject("missing_header", status.HTTP_401_UNAUTHORIZED,
+                             "Missing or invalid Authorization header")
+
+            api_key = await self.validate(credentials.credentials,
+                                          request.client.host if request.client else None)
+            if not api_key:
+                raise reject("invalid_key", status.HTTP_401_UNAUTHORIZED, "Invalid API key")
+
+            if permissions_required:
+                if not any(perm in api_key.permissions for perm in permissions_required):
+                    raise reject("forbidden", status.HTTP_403_FORBIDDEN, "Insufficient permissions")
+
+            limiter = self.manager.rate_limiter
+            with metrics.timer("phase_seconds", phase="rate_limit"):
+                if isinstance(limiter, SQLiteRateLimiter):
+                    allowed, rate_info = await asyncio.to_thread(limiter.hit, api_key.id, api_key.rate_limit)
+                else:
+                    allowed, rate_info = limiter.hit(api_key.id, api_key.rate_limit)
+            if not allowed:
+                metrics.increment("rate_limited_total")
+                retry_after = max(1, math.ceil(rate_info.retry_after))
+                raise reject("rate_limited", status.HTTP_429_TOO_MANY_REQUESTS,
+                             {"error": "Rate limit exceeded", "retry_after": retry_after},
+                             {"Retry-After": str(retry_after)})
+
+            # Fire-and-forget: dropped (and counted) if the writer is backed up
+            route = request.scope.get("route")
+            queued = self.manager.usage_writer.log_usage(
+                api_key.id,
+                route.path if route else request.url.path,
+                request.method,
+                datetime.utcnow(),
+                request.client.host if request.client else None,
+                request.headers.get("user-agent"),
+                block=False
+            )
+            if not queued:
+                metrics.increment("usage_events_dropped_total")
+
+            request.state.rate_limit_remaining = max(0, rate_info.limit - rate_info.requests_made)
+            metrics.observe("auth_seconds", time.perf_counter() - started)
+            return api_key
+
+        return dependency
+
+# One uvicorn worker keeps its limits in memory; pass SQLiteRateLimiter
+# instead when running several workers against the same database file
+api_manager = APIKeyManager(
+    rate_limiter=InMemoryRateLimiter(),
+    metrics=PrometheusMetrics() if APIKeyConfig.METRICS_ENABLED else Metrics()
+)
+api_auth = AsyncAPIKeyAuth(api_manager)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await api_auth.startup()
+    yield
+    await api_auth.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Pydantic Models
+class CreateKeyRequest(BaseModel):
+    name: str
+    user_id: str
+    permissions: List[str] = ["read"]
+    rate_limit: Optional[int] = None
+    expires_in_days: Optional[int] = None
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint (set API_KEY_METRICS=1); keep it off public networks"""
+    if not APIKeyConfig.METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+    return Response(api_manager.metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Example API endpoints
+@app.get("/api/data")
+async def get_data(request: Request, api_key: APIKey = Depends(api_auth.require(["read", "data"]))):
+    """Example protected endpoint"""
+    return {
+        "data": "This is protected data",
+        "user_id": api_key.user_id,
+        "rate_limit_remaining": request.state.rate_limit_remaining
+    }
+
+@app.post("/api/admin/keys")
+async def create_api_key(body: CreateKeyRequest,
+                         api_key: APIKey = Depends(api_auth.require(["admin"]))):
+    """Create new API key (admin only)"""
+    key_string, new_key = await asyncio.to_thread(
+        api_manager.generate_api_key,
+        name=body.name,
+        user_id=body.user_id,
+        permissions=body.permissions,
+        rate_limit=body.rate_limit,
+        expires_in_days=body.expires_in_days
+    )
+
+    return {
+        "key": key_string,  # Only return once!
+        "id": new_key.id,
+        "name": new_key.name,
+        "expires_at": new_key.expires_at.isoformat() if new_key.expires_at else None
+    }
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,4 +1,13 @@
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
 import os
+import tempfile
+import threading
+from importlib import metadata
+from concurrent.futures import ProcessPoolExecutor
 from markitdown import MarkItDown
 #from langchain_community.llms import Ollama
 from langchain_ollama import OllamaLLM
@@ -9,42 +18,145 @@ from langchain_core.documents import Document
 
 from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.outputs import LLMResult
+try:
+    import tiktoken  # optional: exact counts for models with a known BPE encoding
+except ImportError:
+    tiktoken = None
 import time # To measure local time
 from datetime import datetime
 # --- New: Custom Callback Handler for detailed output ---
+FINAL_ANSWER_TAG = "final_answer"  # tag on the LLM call whose tokens are streamed to the output file
+
 class DetailedOutputCallbackHandler(BaseCallbackHandler):
     """
     A custom callback handler to capture and print detailed LLM output,
     including token usage and generation info.
+    Tokens of calls tagged FINAL_ANSWER_TAG are written to stream_file as
+    they arrive. Every call is timed (time to first token, tokens/sec) and
+    combined with Ollama's own durations from generation_info; summary()
+    returns them as JSON-ready metrics. Safe for concurrent (batched) calls.
+    Ollama's prompt_eval_count is fed back to token_counter to calibrate it.
     """
-    def __init__(self):
+    def __init__(self, stream_file: str = None, token_counter: "TokenCounter" = None):
         self.llm_output = None
         self.generation_info = None
-
-    def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        self.stream_file = stream_file
+        self.token_counter = token_counter
+        self.runs = []
+        self.started = time.perf_counter()
+        self.answer_first_token = None
+        self._active = {}  # run_id -> per-call timing state
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs) -> None:
+        """Run when LLM starts running."""
+        stream = None
+        if self.stream_file and FINAL_ANSWER_TAG in (tags or []):
+            stream = open(self.stream_file, "w")
+        with self._lock:
+            self._active[run_id] = {"started": time.perf_counter(), "first_token": None,
+                                    "chunks": 0, "stream": stream,
+                                    "prompt_chars": sum(len(prompt) for prompt in prompts)}
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs) -> None:
+        """Run on every streamed token."""
+        state = self._active.get(run_id)
+        if state is None:
+            return
+        if state["first_token"] is None:
+            state["first_token"] = time.perf_counter()
+            if state["stream"] and self.answer_first_token is None:
+                self.answer_first_token = state["first_token"]
+        state["chunks"] += 1
+        if state["stream"] and token:
+            state["stream"].write(token)
+            state["stream"].flush()
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs) -> None:
+        with self._lock:
+            state = self._active.pop(run_id, None)
+        if state and state["stream"]:
+            state["stream"].close()
+
+    def on_llm_end(self, response: LLMResult, *, run_id=None, **kwargs) -> None:
         """Run when LLM ends running."""
         # Store the raw LLMResult
         self.llm_output = response
 
         # Extract generation info (which contains token usage for many models)
         # For Ollama, token usage details are often nested in generation_info of the first generation
+        generation_info = None
         if response.generations and response.generations[0]:
-            self.generation_info = response.generations[0][0].generation_info
-        print("\n--- LLM Call Finished ---")
-        # print("Full LLMResult Object:")
-        # print(response) # Uncomment this if you want to see the full raw object
-
-        if self.generation_info:
-            print("\nGeneration Info (from LLMResult):")
-            #for key, value in self.generation_info.items():
-            #    print(f"  {key}: {value}")
-            print("\n") # Add a newline for readability
+            generation_info = response.generations[0][0].generation_info
+            self.generation_info = generation_info
+        with self._lock:
+            state = self._active.pop(run_id, None)
+        if state is None:
+            return
+        if state["stream"]:
+            state["stream"].close()
+
+        metrics = self._call_metrics(state, generation_info or {})
+        if self.token_counter and metrics["prompt_tokens"]:
+            self.token_counter.calibrate(state["prompt_chars"], metrics["prompt_tokens"])
+        with self._lock:
+            self.runs.append(metrics)
+        print(f"\n--- LLM Call Finished: ttft {metrics['ttft_seconds']}s, "
+              f"{metrics['tokens_per_second']} tok/s, prompt eval {metrics['prompt_eval_seconds']}s, "
+              f"total {metrics['total_seconds']}s ---")
+
+    @staticmethod
+    def _call_metrics(state: dict, info: dict) -> dict:
+        # Ollama reports durations in nanoseconds
+        def seconds(key):
+            return info[key] / 1e9 if info.get(key) is not None else None
+        ended = time.perf_counter()
+        first_token = state["first_token"]
+        output_tokens = info.get("eval_count", state["chunks"])
+        eval_seconds = seconds("eval_duration")
+        if not eval_seconds and first_token is not None:
+            eval_seconds = ended - first_token
+        return {
+            "model": info.get("model"),
+            "final_answer": state["stream"] is not None,
+            "ttft_seconds": round(first_token - state["started"], 4) if first_token else None,
+            "wall_seconds": round(ended - state["started"], 4),
+            "prompt_tokens": info.get("prompt_eval_count"),
+            "output_tokens": output_tokens,
+            "tokens_per_second": round(output_tokens / eval_seconds, 2) if eval_seconds else None,
+            "prompt_eval_seconds": seconds("prompt_eval_duration"),
+            "eval_seconds": eval_seconds,
+            "load_seconds": seconds("load_duration"),
+            "total_seconds": seconds("total_duration"),
+        }
+
+    def summary(self, **fields) -> dict:
+        """Metrics for every call handled so far plus totals, as one JSON-ready dict"""
+        with self._lock:
+            runs = list(self.runs)
+        def total(key):
+            return sum(run[key] or 0 for run in runs)
+        eval_seconds = total("eval_seconds")
+        return {
+            **fields,
+            "calls": len(runs),
+            "answer_ttft_seconds": (round(self.answer_first_token - self.started, 4)
+                                    if self.answer_first_token else None),
+            "wall_seconds": round(time.perf_counter() - self.started, 4),
+            "prompt_tokens": total("prompt_tokens"),
+            "output_tokens": total("output_tokens"),
+            "tokens_per_second": round(total("output_tokens") / eval_seconds, 2) if eval_seconds else None,
+            "prompt_eval_seconds": round(total("prompt_eval_seconds"), 4),
+            "ollama_total_seconds": round(total("total_seconds"), 4),
+            "runs": runs,
+        }
 
 # --- Part 1: Convert XLS to Markdown using MarkItDown ---
 
-def convert_xls_to_markdown(xls_file_path: str) -> str:
+def convert_xls_to_markdown(xls_file_path: str, markdown_file: str = None) -> str:
     """
     Converts an XLS file to Markdown using Microsoft's MarkItDown library.
+    The result is also written to markdown_file (default: "<xls_file_path>.md").
     """
     if not os.path.exists(xls_file_path):
         raise FileNotFoundError(f"XLS file not found: {xls_file_path}")
@@ -56,7 +168,7 @@ def convert_xls_to_markdown(xls_file_path: str) -> str:
         #print(f"Conversion successful. Markdown content:\n{result}\n\n")
         markdown_content = result.text_content.replace('NaN', '')
 
-        with open(f"{xls_file_path}.md", "w") as f:
+        with open(markdown_file or f"{xls_file_path}.md", "w") as f:
             f.write(markdown_content)
 
         print("Conversion successful.")
@@ -67,138 +179,619 @@ def convert_xls_to_markdown(xls_file_path: str) -> str:
 
 # --- Part 2: Explain Markdown using LangChain and Ollama (Gemma 3:4b) ---
 
-def explain_markdown_with_ollama(markdown_content: str, explain_file: str):
-    """
-    Feeds Markdown content to Ollama (Gemma 3:4b) via LangChain to get an explanation.
-    """
-    if not markdown_content:
-        print("No Markdown content to explain.")
-        return
-
-    print("\n--- Explaining Markdown with Ollama (Gemma 3:4b) ---")
-
-    # 1. Initialize Ollama LLM
-    # Ensure Ollama is running and gemma3:4b is pulled
-    try:
-        # Initialize the custom callback handler
-        callback_handler = DetailedOutputCallbackHandler()
-#        llm = OllamaLLM(model="gemma3:4b",base_url="http://localhost:11434",callbacks=[callback_handler])
-        llm = OllamaLLM(model="phi4:latest",base_url="http://localhost:11434",callbacks=[callback_handler])
-        #llm = OllamaLLM(model="phi4:latest",base_url="http://172.29.136.30:11435",callbacks=[callback_handler])
-    except Exception as e:
-        print(f"Error initializing Ollama. Make sure Ollama is running and 'gemma3:4b' is pulled. Error: {e}")
-        return
-
-    # 2. Create a Document object from the Markdown content
-    # TextLoader expects a file, so we wrap the string in a Document object directly.
-    # For very large markdown, you might use TextLoader with a temp file or chunks.
-    if len(markdown_content) > 75000:
-        markdown_content = markdown_content[:75000]
-        print("Markdown content was truncated to 20000 characters.")
-    doc = Document(page_content=markdown_content, metadata={"source": "excel_to_markdown_conversion"})
-
-    # 3. Define the Prompt Template
-    '''
-    prompt = ChatPromptTemplate.from_template(
-        """You are an intelligent assistant. Your task is to analyze the provided Markdown content,
+MODEL_NAME = os.getenv("OLLAMA_MODEL", "phi4:latest")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+CONTEXT_TOKENS = 16384     # num_ctx requested from Ollama (its default silently truncates long prompts)
+CHUNK_TOKENS = 6000        # markdown per map call, leaving room for the prompt and the answer
+MAP_CONCURRENCY = 4        # keep at or below OLLAMA_NUM_PARALLEL on the server
+MAX_STUFF_TOKENS = 15000   # "stuff" mode only (rest of num_ctx is prompt and answer); map_reduce never drops content
+CHARS_PER_TOKEN = 4.0      # starting estimate for models without a local tokenizer; calibrated per model
+# Models whose tokenizer is a tiktoken encoding, matched by name prefix
+MODEL_ENCODINGS = {"phi4": "cl100k_base", "phi-4": "cl100k_base"}
+
+SUMMARY_TEMPLATE = """You are an intelligent assistant. Your task is to analyze and  provide summary of the provided Markdown content,
         which was generated from an Excel file.
         Please describe the structure, main purpose, and key information presented in this Markdown.
-        Highlight important contents.
         Focus on providing a clear and concise explanation as if you're helping someone understand the data.
 
         Make sure explanation should not exceed 300 words.
         Markdown Content:
         {context}
 
-        Explanation:
+        Summary:
         """
-    )
 
-    '''
-    prompt = ChatPromptTemplate.from_template(
-        """You are an intelligent assistant. Your task is to analyze and  provide summary of the provided Markdown content,
-        which was generated from an Excel file.
-        Please describe the structure, main purpose, and key information presented in this Markdown.
-        Focus on providing a clear and concise explanation as if you're helping someone understand the data.
+MAP_TEMPLATE = """You are an intelligent assistant. The Markdown content below is part {part} of {parts}
+        of a document that was generated from an Excel file.
+        Summarize the structure and key information in this part: sheet names, what the columns mean,
+        and notable values or answers. Do not guess about the other parts.
 
-        Make sure explanation should not exceed 300 words.
         Markdown Content:
         {context}
 
+        Partial Summary:
+        """
+
+REDUCE_TEMPLATE = """You are an intelligent assistant. Below are summaries of consecutive parts of one
+        Markdown document that was generated from an Excel file.
+        Combine them into a single summary describing the structure, main purpose, and key information.
+        Focus on providing a clear and concise explanation as if you're helping someone understand the data.
+
+        Make sure explanation should not exceed 300 words.
+        Partial Summaries:
+        {summaries}
+
         Summary:
         """
+
+class TokenCounter:
+    """
+    Local token counts for one model, so budgeting never calls llm.get_num_tokens
+    (which falls back to a slow generic tokenizer for Ollama models).
+    Uses the model's tiktoken encoding when one is known and installed;
+    otherwise estimates from a chars-per-token ratio that calibrate() refines
+    with the prompt_eval_count Ollama reports for real prompts.
+    """
+    MIN_CALIBRATION_CHARS = 2000  # short prompts are dominated by the chat template
+
+    def __init__(self, model: str, chars_per_token: float = CHARS_PER_TOKEN):
+        self.model = model
+        self.encoding = self._load_encoding(model)
+        self.chars_per_token = chars_per_token
+        self._calibration = [0, 0]  # chars, tokens observed so far
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_encoding(model: str):
+        name = next((encoding for prefix, encoding in MODEL_ENCODINGS.items()
+                     if model.lower().startswith(prefix)), None)
+        if tiktoken is None or name is None:
+            return None
+        try:
+            return tiktoken.get_encoding(name)
+        except Exception as e:  # the BPE file is downloaded on first use
+            print(f"Could not load tokenizer '{name}' for {model}, estimating instead: {e}")
+            return None
+
+    @property
+    def exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return int(len(text) / self.chars_per_token) + 1
+
+    def fit(self, text: str, max_tokens: int) -> tuple:
+        """Returns (text cut to at most max_tokens, its token count), tokenizing once"""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text, len(tokens)
+            return self.encoding.decode(tokens[:max_tokens]), max_tokens
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text, tokens
+        return text[:int(max_tokens * self.chars_per_token)], max_tokens
+
+    def calibrate(self, chars: int, tokens: int):
+        """Folds an observed (prompt chars, prompt tokens) pair into the estimate"""
+        if self.encoding is not None or chars < self.MIN_CALIBRATION_CHARS:
+            return
+        # Ollama only counts tokens it had to evaluate; a reused prompt cache reports fewer
+        if not 1.0 <= chars / max(1, tokens) <= 8.0:
+            return
+        with self._lock:
+            self._calibration[0] += chars
+            self._calibration[1] += tokens
+            self.chars_per_token = self._calibration[0] / self._calibration[1]
+
+_token_counters = {}
+_token_counters_lock = threading.Lock()
+
+def token_counter(model: str = MODEL_NAME) -> TokenCounter:
+    """One TokenCounter per model for the whole process, so calibration carries across documents"""
+    with _token_counters_lock:
+        if model not in _token_counters:
+            _token_counters[model] = TokenCounter(model)
+        return _token_counters[model]
+
+def estimate_tokens(text: str, model: str = MODEL_NAME) -> int:
+    return token_counter(model).count(text)
+
+def split_markdown(markdown_content: str, max_tokens: int = CHUNK_TOKENS, count_tokens=estimate_tokens) -> list:
+    """
+    Splits MarkItDown output into chunks of at most max_tokens.
+    Breaks on sheet ("## Sheet") boundaries first and between table rows
+    inside sheets that are too large; such pieces repeat the sheet heading
+    and table header so every chunk stands on its own. Nothing is dropped.
+    Returns (chunk, token count) pairs; each section is counted once.
+    """
+    pieces = []
+    for section in _split_sections(markdown_content):
+        tokens = count_tokens(section)
+        if tokens <= max_tokens:
+            pieces.append((section, tokens))
+        else:
+            pieces.extend(_split_table_rows(section, max_tokens, count_tokens))
+    return _pack(pieces, max_tokens)
+
+def _split_sections(markdown_content: str) -> list:
+    sections, current = [], []
+    for line in markdown_content.split("\n"):
+        if line.startswith("## ") and any(l.strip() for l in current):
+            sections.append("\n".join(current).strip("\n"))
+            current = []
+        current.append(line)
+    if any(l.strip() for l in current):
+        sections.append("\n".join(current).strip("\n"))
+    return sections
+
+def _split_table_rows(section: str, max_tokens: int, count_tokens) -> list:
+    lines = section.split("\n")
+    # Heading plus table header row and |---| separator, repeated in each piece
+    header_end = 0
+    for i, line in enumerate(lines[:6]):
+        if set(line.replace("|", "").replace(":", "").replace(" ", "")) == {"-"} or line.startswith("#"):
+            header_end = i + 1
+    header = "\n".join(lines[:header_end])
+
+    header_tokens = count_tokens(header)
+    room = max(1, max_tokens - header_tokens)
+
+    pieces, rows, used = [], [], 0
+    for row in lines[header_end:]:
+        for part, tokens in _hard_split(row, room, count_tokens):
+            if rows and used + tokens > room:
+                pieces.append(("\n".join([header] + rows) if header else "\n".join(rows), header_tokens + used))
+                rows, used = [], 0
+            rows.append(part)
+            used += tokens
+    if rows:
+        pieces.append(("\n".join([header] + rows) if header else "\n".join(rows), header_tokens + used))
+    return pieces
+
+def _hard_split(text: str, max_tokens: int, count_tokens) -> list:
+    """Last resort for a single row larger than the budget: cut by characters"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return [(text, tokens)]
+    width = max(1, int(len(text) * max_tokens / tokens * 0.9))
+    return [(part, count_tokens(part)) for part in (text[i:i + width] for i in range(0, len(text), width))]
+
+def _pack(pieces: list, max_tokens: int) -> list:
+    """Greedily merges consecutive (text, tokens) pieces while they fit in max_tokens"""
+    chunks, current, used = [], [], 0
+    for piece, tokens in pieces:
+        if current and used + tokens > max_tokens:
+            chunks.append(("\n\n".join(current), used))
+            current, used = [], 0
+        current.append(piece)
+        used += tokens
+    if current:
+        chunks.append(("\n\n".join(current), used))
+    return chunks
+
+def map_reduce_explain(llm, chunks: list, max_concurrency: int = MAP_CONCURRENCY,
+                       counter: TokenCounter = None) -> str:
+    """
+    Summarizes chunks concurrently (map), then merges the partial summaries
+    (reduce), collapsing them in rounds if they do not fit in one call.
+    """
+    counter = counter or token_counter(llm.model)
+    map_chain = ChatPromptTemplate.from_template(MAP_TEMPLATE) | llm
+    reduce_chain = ChatPromptTemplate.from_template(REDUCE_TEMPLATE) | llm
+    batch_config = {"max_concurrency": max_concurrency}
+
+    started = time.perf_counter()
+    summaries = map_chain.batch(
+        [{"context": chunk, "part": i + 1, "parts": len(chunks)} for i, chunk in enumerate(chunks)],
+        config=batch_config
     )
+    print(f"Summarized {len(chunks)} chunks in {time.perf_counter() - started:.1f}s")
+
+    previous_tokens = None
+    while len(summaries) > 1:
+        pieces = [(summary, counter.count(summary)) for summary in summaries]
+        total_tokens = sum(tokens for _, tokens in pieces)
+        groups = _pack(pieces, CHUNK_TOKENS)
+        if len(groups) == 1:
+            break
+        if len(groups) == len(summaries):
+            # No two summaries fit together, so all of them would overflow num_ctx
+            if previous_tokens is not None and total_tokens >= previous_tokens:
+                # Condensing stopped shrinking them: cut each to its share of the final prompt
+                share = max(1, CHUNK_TOKENS // len(summaries))
+                summaries = [_hard_split(summary, share, counter.count)[0][0] for summary in summaries]
+                print(f"Truncated {len(summaries)} partial summaries to fit the final prompt")
+                break
+            # Condense each one on its own, cutting any that alone exceed the budget
+            groups = [part for summary, _ in pieces for part in _hard_split(summary, CHUNK_TOKENS, counter.count)]
+        previous_tokens = total_tokens
+        summaries = reduce_chain.batch([{"summaries": group} for group, _ in groups], config=batch_config)
+        print(f"Collapsed partial summaries into {len(summaries)}")
+
+    numbered = "\n\n".join(f"Part {i + 1}:\n{summary}" for i, summary in enumerate(summaries))
+    return reduce_chain.invoke({"summaries": numbered}, config={"tags": [FINAL_ANSWER_TAG]})
+
+def explain_markdown_with_ollama(markdown_content: str, explain_file: str, mode: str = "auto",
+                                 model: str = MODEL_NAME, base_url: str = OLLAMA_BASE_URL,
+                                 max_concurrency: int = MAP_CONCURRENCY,
+                                 callback_handler: "DetailedOutputCallbackHandler" = None) -> str:
+    """
+    Feeds Markdown content to Ollama via LangChain to get an explanation.
+    mode "stuff" sends everything in one prompt (truncated to MAX_STUFF_TOKENS),
+    "map_reduce" summarizes sheet/table chunks concurrently and merges them,
+    and "auto" stuffs documents that fit in one chunk and map-reduces the rest.
+    The answer streams into explain_file as it is generated, and per-call
+    timings are written to "<explain_file>.metrics.json".
+    Returns the explanation, or None if it could not be produced.
+    """
+    if not markdown_content:
+        print("No Markdown content to explain.")
+        return None
 
-    prompt_value = prompt.invoke({"context": [doc]})
-    full_prompt_string = prompt_value.to_string() 
-    prompt_token_count = llm.get_num_tokens(full_prompt_string)
-    print("=" * 80)
-    print(f"Total MD length: {len(markdown_content)}")
-    print(f"Prompt Token Count: {prompt_token_count}")
-    print("=" * 80)
+    print(f"\n--- Explaining Markdown with Ollama ({model}) ---")
 
+    # 1. Initialize Ollama LLM
+    # Ensure Ollama is running and the model is pulled
+    try:
+        # Initialize the custom callback handler
+        counter = token_counter(model)
+        callback_handler = callback_handler or DetailedOutputCallbackHandler(stream_file=explain_file)
+        callback_handler.token_counter = callback_handler.token_counter or counter
+#        llm = OllamaLLM(model="gemma3:4b",base_url="http://localhost:11434",callbacks=[callback_handler])
+        llm = OllamaLLM(model=model, base_url=base_url, num_ctx=CONTEXT_TOKENS, callbacks=[callback_handler])
+        #llm = OllamaLLM(model="phi4:latest",base_url="http://172.29.136.30:11435",callbacks=[callback_handler])
+    except Exception as e:
+        print(f"Error initializing Ollama. Make sure Ollama is running and '{model}' is pulled. Error: {e}")
+        return None
+
+    # Token counts are computed once here and reused for budgeting and logging
+    if mode == "stuff":
+        markdown_tokens = counter.count(markdown_content)
+        chunks = [(markdown_content, markdown_tokens)]
+    else:
+        chunks = split_markdown(markdown_content, count_tokens=counter.count)
+        markdown_tokens = sum(tokens for _, tokens in chunks)
+    if mode == "auto":
+        mode = "stuff" if len(chunks) == 1 else "map_reduce"
 
-    # 4. Create a Stuff Documents Chain
-    # This chain will "stuff" the entire document content into the LLM's context.
-    document_chain = create_stuff_documents_chain(llm, prompt)
+    print("=" * 80)
+    print(f"Total MD length: {len(markdown_content)} ({markdown_tokens} tokens, "
+          f"{'exact' if counter.exact else f'~{counter.chars_per_token:.2f} chars/token'})")
+    print(f"Mode: {mode} ({len(chunks)} chunks)")
 
-    # 5. Invoke the chain to get the explanation
     try:
-        response = document_chain.invoke({"context": [doc]}) # Pass a list containing the Document object
-        #print("\nOllama's Explanation:")
-        #print(response)
+        if mode == "map_reduce":
+            print("=" * 80)
+            response = map_reduce_explain(llm, [chunk for chunk, _ in chunks], max_concurrency, counter)
+        else:
+            # 2. Create a Document object from the Markdown content
+            if markdown_tokens > MAX_STUFF_TOKENS:
+                markdown_content, markdown_tokens = counter.fit(markdown_content, MAX_STUFF_TOKENS)
+                print(f"Markdown content was truncated to {MAX_STUFF_TOKENS} tokens.")
+            doc = Document(page_content=markdown_content, metadata={"source": "excel_to_markdown_conversion"})
+
+            # 3. Define the Prompt Template
+            prompt = ChatPromptTemplate.from_template(SUMMARY_TEMPLATE)
+
+            prompt_token_count = markdown_tokens + counter.count(SUMMARY_TEMPLATE)
+            print(f"Prompt Token Count: {prompt_token_count}")
+            print("=" * 80)
+
+            # 4. Create a Stuff Documents Chain
+            # This chain will "stuff" the entire document content into the LLM's context.
+            document_chain = create_stuff_documents_chain(llm, prompt)
+
+            # 5. Invoke the chain to get the explanation
+            response = document_chain.invoke({"context": [doc]}, config={"tags": [FINAL_ANSWER_TAG]}) # Pass a list containing the Document object
+
         with open(explain_file, "w") as f:
             f.write(response)
 
-
-        answer_token = llm.get_num_tokens(response)
-        print("=" * 80              )   
+        metrics = callback_handler.summary(model=model, mode=mode, chunks=len(chunks),
+                                           markdown_chars=len(markdown_content),
+                                           markdown_tokens=markdown_tokens)
+        # Ollama's eval_count for the final call is the exact answer length
+        final_runs = [run for run in metrics["runs"] if run["final_answer"]]
+        answer_token = final_runs[-1]["output_tokens"] if final_runs else counter.count(response)
+        print("=" * 80)
         print(f"Answer Token Count: {answer_token}")
         print("=" * 80)
 
+        with open(f"{explain_file}.metrics.json", "w") as f:
+            json.dump(metrics, f, indent=2)
+        print(json.dumps({key: value for key, value in metrics.items() if key != "runs"}))
+        return response
 
     except Exception as e:
         print(f"Error invoking Ollama chain: {e}")
         print("Common issues: Ollama server not running, model not downloaded, or context window exceeded.")
+        return None
+
 
+# --- Part 3: Content-addressed cache for Markdown and explanations ---
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+class ExplainCache:
+    """
+    On-disk cache of converted Markdown and LLM explanations.
+    Markdown is keyed by the workbook's content hash and the MarkItDown
+    version; explanations by the Markdown's hash, the model, the mode and a
+    hash of the prompt templates and chunking settings. Entries are written
+    atomically, so conversion processes can share the directory. evict()
+    drops least recently used entries (by mtime, refreshed on every hit)
+    until the cache fits in max_bytes.
+    """
+    def __init__(self, cache_dir: str = ".explain_cache", max_bytes: int = 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _digest(*parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else str(part).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def markdown_key(self, xls_file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(xls_file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return self._digest(digest.hexdigest(), _package_version("markitdown"))
+
+    def explanation_key(self, markdown_content: str, model: str, mode: str) -> str:
+        prompt_hash = self._digest(SUMMARY_TEMPLATE, MAP_TEMPLATE, REDUCE_TEMPLATE, CHUNK_TOKENS,
+                                   CONTEXT_TOKENS, MAX_STUFF_TOKENS)
+        return self._digest(markdown_content, model, mode, prompt_hash)
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.cache_dir, kind, key[:2], key)
+
+    def get(self, kind: str, key: str):
+        path = self._path(kind, key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)  # mark as recently used
+            return text
+        except FileNotFoundError:
+            return None
+
+    def put(self, kind: str, key: str, text: str):
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+    def evict(self) -> int:
+        """Removes least recently used entries above max_bytes; returns how many"""
+        entries, total = [], 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+# --- Part 4: Batch mode over directories and globs ---
+
+WORKBOOK_EXTENSIONS = (".xlsx", ".xlsm", ".xls")
+
+def expand_inputs(inputs: list) -> list:
+    """Files, directories (searched recursively for workbooks) and glob patterns, de-duplicated"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, names in os.walk(item):
+                paths.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.lower().endswith(WORKBOOK_EXTENSIONS) and not name.startswith("~$"))
+        elif glob.has_magic(item):
+            paths.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            paths.append(item)
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+def output_paths(xls_file_path: str, output_dir: str, used_names: set) -> tuple:
+    """(markdown_file, explain_file); next to the workbook unless output_dir is set"""
+    if not output_dir:
+        return f"{xls_file_path}.md", f"{xls_file_path}_explain.md"
+    name = os.path.basename(xls_file_path)
+    stem, suffix = name, 1
+    while name in used_names:
+        suffix += 1
+        name = f"{stem}.{suffix}"
+    used_names.add(name)
+    return os.path.join(output_dir, f"{name}.md"), os.path.join(output_dir, f"{name}_explain.md")
+
+def timed_convert(xls_file_path: str, markdown_file: str, cache: ExplainCache = None) -> tuple:
+    """Process pool entry point: (markdown, seconds, served from cache)"""
+    started = time.perf_counter()
+    if cache:
+        key = cache.markdown_key(xls_file_path)
+        markdown_content = cache.get("markdown", key)
+        if markdown_content is not None:
+            with open(markdown_file, "w") as f:
+                f.write(markdown_content)
+            return markdown_content, time.perf_counter() - started, True
+    markdown_content = convert_xls_to_markdown(xls_file_path, markdown_file)
+    if cache and markdown_content:
+        cache.put("markdown", key, markdown_content)
+    return markdown_content, time.perf_counter() - started, False
+
+async def run_batch(paths: list, output_dir: str = None, workers: int = None, llm_concurrency: int = 4,
+                    mode: str = "auto", model: str = MODEL_NAME, base_url: str = OLLAMA_BASE_URL,
+                    cache: ExplainCache = None) -> dict:
+    """
+    Converts workbooks in a process pool and explains them through a bounded
+    queue drained by llm_concurrency consumers, so at most llm_concurrency
+    requests are in flight against Ollama (set it to OLLAMA_NUM_PARALLEL).
+    At most one conversion per worker is submitted at a time, and a full queue
+    holds converted markdown back, so memory stays bounded for large batches.
+    With a cache, unchanged workbooks skip conversion and the LLM entirely.
+    """
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=llm_concurrency * 2)
+    conversions = asyncio.Semaphore(workers or os.cpu_count() or 1)
+    used_names = set()
+    results = []
+    started = time.perf_counter()
+
+    async def convert(pool, path):
+        markdown_file, explain_file = output_paths(path, output_dir, used_names)
+        result = {"file": path, "markdown_file": markdown_file, "explain_file": explain_file}
+        results.append(result)
+        # Held until the markdown is queued, so a slow LLM also pauses conversion
+        async with conversions:
+            await convert_one(pool, result)
+
+    async def convert_one(pool, result):
+        path, markdown_file, explain_file = result["file"], result["markdown_file"], result["explain_file"]
+        try:
+            markdown_content, result["convert_seconds"], result["markdown_cached"] = (
+                await loop.run_in_executor(pool, timed_convert, path, markdown_file, cache))
+        except Exception as e:
+            markdown_content, result["error"] = "", f"conversion failed: {e}"
+        if not markdown_content:
+            result.setdefault("error", "conversion produced no markdown")
+            result["status"] = "failed"
+            return
+        result["markdown_chars"] = len(markdown_content)
+
+        if cache:
+            result["explanation_key"] = cache.explanation_key(markdown_content, model, mode)
+            explanation = cache.get("explanation", result["explanation_key"])
+            result["explanation_cached"] = explanation is not None
+            if explanation is not None:
+                with open(explain_file, "w") as f:
+                    f.write(explanation)
+                result["status"] = "ok"
+                return
+        await queue.put((result, markdown_content))
+
+    async def explain_worker():
+        while True:
+            result, markdown_content = await queue.get()
+            explain_started = time.perf_counter()
+            try:
+                # One request in flight per consumer: map-reduce chunks run sequentially here
+                handler = DetailedOutputCallbackHandler(stream_file=result["explain_file"],
+                                                        token_counter=token_counter(model))
+                response = await asyncio.to_thread(
+                    explain_markdown_with_ollama, markdown_content, result["explain_file"],
+                    mode, model, base_url, 1, handler)
+                result["llm"] = {key: value for key, value in handler.summary().items() if key != "runs"}
+                result["status"] = "ok" if response is not None else "failed"
+                if response is None:
+                    result["error"] = "explanation failed"
+                elif cache:
+                    cache.put("explanation", result.pop("explanation_key"), response)
+            except Exception as e:
+                result["status"], result["error"] = "failed", f"explanation failed: {e}"
+            result["explain_seconds"] = time.perf_counter() - explain_started
+            queue.task_done()
+
+    consumers = [asyncio.create_task(explain_worker()) for _ in range(llm_concurrency)]
+    with ProcessPoolExecutor(workers) as pool:
+        await asyncio.gather(*(convert(pool, path) for path in paths))
+    await queue.join()
+    for consumer in consumers:
+        consumer.cancel()
+    evicted = await asyncio.to_thread(cache.evict) if cache else 0
+
+    failed = [result for result in results if result["status"] != "ok"]
+    return {
+        "model": model,
+        "mode": mode,
+        "files": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "wall_seconds": time.perf_counter() - started,
+        "convert_seconds": sum(result.get("convert_seconds", 0.0) for result in results),
+        "explain_seconds": sum(result.get("explain_seconds", 0.0) for result in results),
+        "llm_calls": sum(result.get("llm", {}).get("calls", 0) for result in results),
+        "output_tokens": sum(result.get("llm", {}).get("output_tokens", 0) for result in results),
+        "markdown_cache_hits": sum(bool(result.get("markdown_cached")) for result in results),
+        "explanation_cache_hits": sum(bool(result.get("explanation_cached")) for result in results),
+        "cache_evictions": evicted,
+        "results": results,
+    }
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Convert Excel workbooks to Markdown and explain them with Ollama")
+    parser.add_argument("inputs", nargs="*", default=["./data/AI_RFX_Answered_harsha_Technical_SoCs.xlsx"],
+                        help="workbook files, directories or glob patterns")
+    parser.add_argument("--output-dir", help="write outputs here instead of next to each workbook")
+    parser.add_argument("--summary", default="batch_summary.json", help="timings and failures (JSON)")
+    parser.add_argument("--workers", type=int, default=None, help="conversion processes (default: CPU count)")
+    parser.add_argument("--llm-concurrency", type=int, default=MAP_CONCURRENCY,
+                        help="concurrent Ollama requests; match OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--mode", choices=["auto", "stuff", "map_reduce"], default="auto")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--base-url", default=OLLAMA_BASE_URL)
+    parser.add_argument("--cache-dir", default=os.getenv("EXPLAIN_CACHE_DIR", ".explain_cache"))
+    parser.add_argument("--cache-max-mb", type=int, default=1024, help="LRU size bound of the cache")
+    parser.add_argument("--no-cache", action="store_true", help="always convert and query the model")
+    args = parser.parse_args(argv)
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("No workbooks found.")
+        return 1
+
+    cache = None if args.no_cache else ExplainCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+    summary = asyncio.run(run_batch(paths, args.output_dir, args.workers, args.llm_concurrency,
+                                    args.mode, args.model, args.base_url, cache))
+    summary_file = os.path.join(args.output_dir, args.summary) if args.output_dir else args.summary
+    with open(summary_file, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"Processed {summary['files']} files: {summary['succeeded']} ok, {summary['failed']} failed "
+          f"in {summary['wall_seconds']:.1f}s (summary: {summary_file})")
+    for result in summary["results"]:
+        if result["status"] != "ok":
+            print(f"  FAILED {result['file']}: {result.get('error')}")
+    return 0 if not summary["failed"] else 1
 
 # --- Main Execution ---
 
 if __name__ == "__main__":
-    # Create a dummy XLS file for demonstration
-    # In a real scenario, you would have your own .xls file
-
+    # One workbook (the default path below) or a batch, e.g.
+    #   python MarkdownExplainerllm.py ./data "rfx/**/*.xlsx" --output-dir ./out --llm-concurrency 4
     startime = datetime.now()
+    exit_code = 1
     try:
-        # Save to .xls (requires xlwt, but MarkItDown prefers openpyxl for xlsx)
-        # For .xls, pandas might try to use older engines which can be tricky.
-        # It's highly recommended to use .xlsx for better compatibility.
-        # Let's create an .xlsx file instead, as it's more modern and widely supported by MarkItDown.
-        xlsx_file_name = "./data/AI_RFX_Answered_harsha_Technical_SoCs.xlsx"
-       
-
-        # Convert the Excel file to Markdown
-        markdown_output = convert_xls_to_markdown(xlsx_file_name)
-
-        if markdown_output:
-            print("\n--- Generated Markdown Content ---")
-            #print(markdown_output)
-            #print("----------------------------------")
-
-            # Feed the Markdown content to Ollama for explanation
-            explain_markdown_with_ollama(markdown_output,f'{xlsx_file_name}_explain.md')
-        else:
-            print("Failed to generate Markdown from Excel.")
-
+        exit_code = main()
     except Exception as e:
         print(f"Error: {e}")
-
-        # Example if you have an existing XLS/XLSX:
-        # markdown_output = convert_xls_to_markdown("path/to/your/existing_file.xlsx")
-        # if markdown_output:
-        #     explain_markdown_with_ollama(markdown_output)
     finally:
-        # Clean up the dummy files
         endtime = datetime.now()
         print(f"Total time: {endtime - startime}")
-        print(f"\nCompleted")
\ No newline at end of file
+        print(f"\nCompleted")
+    raise SystemExit(exit_code)
\ No newline at end of file
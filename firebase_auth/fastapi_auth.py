@@ -2,34 +2,69 @@ from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 import firebase_admin
-from firebase_admin import credentials, auth
+from firebase_admin import credentials
 import jwt
 from datetime import datetime, timedelta
 import hashlib
 import uuid
 from typing import Optional
+import asyncio
 import os
 
+from firebase_verifier import FirebaseTokenVerifier
+from revocation import TokenDenylist
+from token_cache import SigningKeySet, UserPrincipal, VerifiedTokenCache
+from user_store import InMemoryUserRepository, UserRecord
+
 # Initialize Firebase Admin SDK
 cred = credentials.Certificate("path/to/your/firebase-service-account.json")
 firebase_admin.initialize_app(cred)
+# ID tokens are checked off the event loop against cached Google certificates
+firebase_verifier = FirebaseTokenVerifier(os.getenv("FIREBASE_PROJECT_ID") or cred.project_id)
 
 app = FastAPI()
 security = HTTPBearer()
 
+@app.on_event("shutdown")
+def close_auth_resources():
+    firebase_verifier.close()
+    revocations.close()
+
 # Configuration
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key")
 JWT_ALGORITHM = "HS256"
-JWT_EXPIRATION_DAYS = 30
+ACCESS_TOKEN_MINUTES = int(os.getenv("ACCESS_TOKEN_MINUTES", "15"))
+JWT_EXPIRATION_DAYS = 30  # refresh token lifetime
+# Rotation: JWT_SIGNING_KEYS="2024-06:secretA,2024-12:secretB", JWT_ACTIVE_KID="2024-12"
+JWT_SIGNING_KEYS = os.getenv("JWT_SIGNING_KEYS", "")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID", "")
+# Secret of tokens issued before kids; only set while those tokens must still verify
+JWT_LEGACY_SECRET = os.getenv("JWT_LEGACY_SECRET", "")
+
+# Verified tokens -> user, so hot endpoints skip the HMAC check and user lookup
+token_cache = VerifiedTokenCache()
+signing_keys = SigningKeySet.from_config(JWT_SIGNING_KEYS, JWT_ACTIVE_KID, JWT_SECRET, JWT_ALGORITHM,
+                                         JWT_LEGACY_SECRET,
+                                         on_retire=lambda kid: token_cache.evict_where(kid=kid))
+# Revoked jti values until their exp; shared by workers through the SQLite file
+revocations = TokenDenylist(
+    os.getenv("REVOKED_TOKENS_DB", "revoked_tokens.db"),
+    on_revoke=lambda jti: token_cache.evict_where(jti=jti)
+)
 
 # Pydantic Models
 class PhoneAuthRequest(BaseModel):
     firebase_id_token: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class AuthResponse(BaseModel):
     token: str
     user_id: str
     expires_at: datetime
+    refresh_token: str
+    refresh_expires_at: datetime
 
 class User(BaseModel):
     id: str
@@ -39,34 +74,47 @@ class User(BaseModel):
     driver_license: Optional[str] = None
     created_at: datetime
 
-# In-memory storage (replace with your database)
-users_db = {}
+# In-memory storage; UserRepository(db) from user_db_sample.py has the same interface
+user_repository = InMemoryUserRepository()
 
 def hash_phone_number(phone: str) -> str:
     """Hash phone number for privacy"""
     return hashlib.sha256(phone.encode()).hexdigest()
 
-def generate_user_id() -> str:
-    """Generate unique user ID"""
-    return f"usr_{uuid.uuid4().hex[:12]}"
-
-def create_jwt_token(user_id: str, firebase_uid: str) -> tuple[str, datetime]:
-    """Create JWT token for the user"""
-    expires_at = datetime.utcnow() + timedelta(days=JWT_EXPIRATION_DAYS)
+def create_jwt_token(user: UserRecord) -> tuple[str, datetime]:
+    """Short-lived token carrying the role claims, so requests need no user lookup"""
+    expires_at = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_MINUTES)
     payload = {
-        "user_id": user_id,
-        "firebase_uid": firebase_uid,
+        "user_id": user.id,
+        "firebase_uid": user.firebase_uid,
+        "name": user.name,
+        "is_active": user.is_active,
+        "is_driver": user.is_driver,
+        "is_parent": user.is_parent,
         "exp": expires_at,
         "iat": datetime.utcnow(),
+        "jti": uuid.uuid4().hex,
         "type": "access"
     }
-    token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    token = signing_keys.encode(payload)
     return token, expires_at
 
+def create_session(user: UserRecord) -> AuthResponse:
+    """Access token plus a rotating refresh token for user"""
+    jwt_token, expires_at = create_jwt_token(user)
+    refresh_expires_at = datetime.utcnow() + timedelta(days=JWT_EXPIRATION_DAYS)
+    return AuthResponse(
+        token=jwt_token,
+        user_id=user.id,
+        expires_at=expires_at,
+        refresh_token=user_repository.create_refresh_token(user.id, refresh_expires_at),
+        refresh_expires_at=refresh_expires_at
+    )
+
 async def verify_firebase_token(firebase_token: str) -> dict:
     """Verify Firebase ID token and return decoded claims"""
     try:
-        decoded_token = auth.verify_id_token(firebase_token)
+        decoded_token = await firebase_verifier.verify(firebase_token)
         return decoded_token
     except Exception as e:
         raise HTTPException(
@@ -74,10 +122,18 @@ async def verify_firebase_token(firebase_token: str) -> dict:
             detail=f"Invalid Firebase token: {str(e)}"
         )
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserPrincipal:
     """Dependency to get current authenticated user"""
+    token = credentials.credentials
+    if revocations.poll_due():
+        # Every few seconds: other workers' logouts evict from token_cache (SQLite, so off the loop)
+        await asyncio.to_thread(revocations.poll)
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
+    
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = signing_keys.decode(token)
         user_id = payload.get("user_id")
         
         if user_id is None:
@@ -86,22 +142,55 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
                 detail="Invalid token payload"
             )
         
-        # Get user from database
-        user = users_db.get(user_id)
-        if user is None:
+        jti = payload.get("jti")
+        # Most tokens miss the Bloom filter in memory; only hits query SQLite
+        if jti and revocations.may_be_revoked(jti) and await asyncio.to_thread(revocations.is_revoked, jti):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked"
+            )
+        
+        if "is_driver" in payload:
+            # Role claims are in the token: no user lookup
+            principal = UserPrincipal(
+                id=user_id,
+                firebase_uid=payload["firebase_uid"],
+                name=payload.get("name"),
+                is_active=payload.get("is_active", True),
+                is_driver=payload["is_driver"],
+                is_parent=payload.get("is_parent", False)
+            )
+        else:
+            # Tokens issued before role claims existed
+            user = user_repository.get_user_by_id(user_id)
+            if user is None:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="User not found"
+                )
+            principal = UserPrincipal(
+                id=user.id,
+                firebase_uid=user.firebase_uid,
+                name=user.name,
+                is_active=user.is_active,
+                is_driver=user.is_driver,
+                is_parent=user.is_parent
+            )
+        if not principal.is_active:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found"
+                detail="User is inactive"
             )
         
-        return user
+        token_cache.put(token, principal, payload["exp"], signing_keys.kid_of(token), user_id, jti)
+        return principal
     
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has expired"
         )
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token"
@@ -127,56 +216,66 @@ async def verify_phone_and_authenticate(request: PhoneAuthRequest):
     # Hash phone number for privacy
     phone_hash = hash_phone_number(phone_number)
     
-    # Check if user exists
-    existing_user = None
-    for user in users_db.values():
-        if user["firebase_uid"] == firebase_uid:
-            existing_user = user
-            break
-    
-    if existing_user:
-        user_id = existing_user["id"]
-    else:
-        # Create new user
-        user_id = generate_user_id()
-        new_user = {
-            "id": user_id,
-            "firebase_uid": firebase_uid,
-            "phone_hash": phone_hash,
-            "name": firebase_claims.get("name"),
-            "created_at": datetime.utcnow()
-        }
-        users_db[user_id] = new_user
+    # Find or create the user in one indexed, atomic step
+    user, _ = user_repository.get_or_create_user(
+        firebase_uid, phone_hash, firebase_claims.get("name")
+    )
     
-    # Create JWT token
-    jwt_token, expires_at = create_jwt_token(user_id, firebase_uid)
+    # Create JWT access token and refresh token
+    return create_session(user)
+
+@app.post("/auth/refresh", response_model=AuthResponse)
+async def refresh_session(request: RefreshRequest):
+    """Trade a refresh token for a new access token and a new refresh token"""
+    refresh_expires_at = datetime.utcnow() + timedelta(days=JWT_EXPIRATION_DAYS)
+    rotated = user_repository.rotate_refresh_token(request.refresh_token, refresh_expires_at)
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token"
+        )
     
+    user, refresh_token = rotated
+    jwt_token, expires_at = create_jwt_token(user)
     return AuthResponse(
         token=jwt_token,
-        user_id=user_id,
-        expires_at=expires_at
+        user_id=user.id,
+        expires_at=expires_at,
+        refresh_token=refresh_token,
+        refresh_expires_at=refresh_expires_at
     )
 
 @app.get("/auth/me")
-async def get_current_user_info(current_user: dict = Depends(get_current_user)):
+async def get_current_user_info(current_user: UserPrincipal = Depends(get_current_user)):
     """Get current user information"""
+    # created_at is not a token claim; this endpoint alone looks the user up
+    user = user_repository.get_user_by_id(current_user.id)
     return {
-        "user_id": current_user["id"],
-        "name": current_user.get("name"),
-        "created_at": current_user["created_at"]
+        "user_id": current_user.id,
+        "name": current_user.name,
+        "created_at": user.created_at if user else None
         # Don't return sensitive data like phone_hash
     }
 
 @app.post("/auth/logout")
-async def logout(current_user: dict = Depends(get_current_user)):
-    """Logout user (in production, you'd add token to blacklist)"""
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """Logout user by revoking this token until it expires, along with their refresh tokens"""
+    token = credentials.credentials
+    payload = signing_keys.decode(token)  # already verified by get_current_user
+    if payload.get("jti"):
+        await asyncio.to_thread(revocations.revoke, payload["jti"], payload["exp"])
+    token_cache.evict_token(token)
+    user_repository.revoke_refresh_tokens(current_user.id)
     return {"message": "Logged out successfully"}
 
 # Protected route example
 @app.get("/rides/my-rides")
-async def get_my_rides(current_user: dict = Depends(get_current_user)):
+async def get_my_rides(current_user: UserPrincipal = Depends(get_current_user)):
     """Get rides for the current user"""
-    user_id = current_user["id"]
+    user_id = current_user.id
     # Your business logic here
     return {"rides": [], "driver_id": user_id}
 
@@ -184,20 +283,24 @@ async def get_my_rides(current_user: dict = Depends(get_current_user)):
 async def register_driver(
     license_number: str,
     vehicle_details: dict,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
-    """Register user as a driver"""
-    user_id = current_user["id"]
+    """Register user as a driver (vehicle_details: registration, model, capacity)"""
+    user_id = current_user.id
     
     # Update user with driver information
-    users_db[user_id].update({
-        "driver_license": license_number,
-        "vehicle_details": vehicle_details,
-        "is_driver": True,
-        "driver_registered_at": datetime.utcnow()
-    })
+    user_repository.create_driver_profile(
+        user_id,
+        license_number,
+        vehicle_registration=vehicle_details.get("registration"),
+        vehicle_model=vehicle_details.get("model"),
+        vehicle_capacity=vehicle_details.get("capacity")
+    )
     
-    return {"message": "Driver registration successful", "driver_id": user_id}
+    # The caller's token still says is_driver=False; hand back one with the new role
+    jwt_token, expires_at = create_jwt_token(user_repository.get_user_by_id(user_id))
+    return {"message": "Driver registration successful", "driver_id": user_id,
+            "token": jwt_token, "expires_at": expires_at}
 
 # Health check
 @app.get("/health")
@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Optional
+import asyncio
+import re
+import time
+
+import httpx
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+GOOGLE_CERTS_URL = (
+    "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+)
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+class FirebaseTokenVerifier:
+    """Async drop-in for firebase_admin.auth.verify_id_token.
+
+    Google's signing certificates are fetched with httpx and kept until their
+    Cache-Control max-age runs out (fallback_max_age_seconds without one, and
+    never less than min_refresh_seconds); concurrent callers share a single refresh.
+    The RS256 signature check runs on a small thread pool so a burst of logins
+    does not stall the event loop. Pass local_keys (kid -> public key) to skip
+    Google entirely, e.g. with LocalFirebaseKeySet in tests.
+    """
+
+    def __init__(self, project_id: str, certs_url: str = GOOGLE_CERTS_URL,
+                 local_keys: Optional[Dict[str, Any]] = None, max_workers: int = 4,
+                 clock_skew_seconds: int = 60, min_refresh_seconds: int = 60,
+                 http_timeout: float = 10.0, fallback_max_age_seconds: int = 300):
+        if not project_id:
+            raise ValueError("A Firebase project id is required to verify ID tokens")
+        self.project_id = project_id
+        self.issuer = f"https://securetoken.google.com/{project_id}"
+        self.certs_url = certs_url
+        self.clock_skew_seconds = clock_skew_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.http_timeout = http_timeout
+        self.fallback_max_age_seconds = fallback_max_age_seconds
+        self._local = local_keys is not None
+        self._keys: Dict[str, Any] = dict(local_keys or {})
+        self._expires_at = float("inf") if self._local else 0.0
+        self._fetched_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="firebase-verify")
+        self.fetches = 0
+
+    async def verify(self, id_token: str) -> Dict[str, Any]:
+        """Verify an ID token and return its claims, with "uid" set like firebase_admin"""
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except jwt.InvalidTokenError as e:
+            raise jwt.InvalidTokenError(f"Malformed Firebase ID token: {e}")
+        if header.get("alg") != "RS256":
+            raise jwt.InvalidTokenError("Firebase ID token must be signed with RS256")
+
+        kid = header.get("kid")
+        keys = await self._public_keys()
+        if kid not in keys:
+            # Google rotates keys before the old max-age expires; refetch once
+            keys = await self._public_keys(force=True)
+        key = keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Firebase ID token has unknown key id '{kid}'")
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._decode, id_token, key)
+
+    def _decode(self, id_token: str, key) -> Dict[str, Any]:
+        claims = jwt.decode(
+            id_token, key, algorithms=["RS256"], audience=self.project_id,
+            issuer=self.issuer, leeway=self.clock_skew_seconds,
+            options={"require": ["exp", "iat", "sub"]}
+        )
+        subject = claims["sub"]
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise jwt.InvalidTokenError("Firebase ID token has an invalid subject")
+        if claims.get("auth_time", 0) > time.time() + self.clock_skew_seconds:
+            raise jwt.InvalidTokenError("Firebase ID token auth_time is in the future")
+        claims["uid"] = subject
+        return claims
+
+    async def _public_keys(self, force: bool = False) -> Dict[str, Any]:
+        if self._local or (not force and time.time() < self._expires_at):
+            return self._keys
+        async with self._refresh_lock:
+            now = time.time()
+            # Another caller refreshed while we waited, or a forced refetch is too soon
+            if now < self._expires_at and (not force or now - self._fetched_at < self.min_refresh_seconds):
+                return self._keys
+            async with httpx.AsyncClient(timeout=self.http_timeout) as client:
+                response = await client.get(self.certs_url)
+                response.raise_for_status()
+            loop = asyncio.get_running_loop()
+            self._keys = await loop.run_in_executor(self._executor, self._load_certificates, response.json())
+            match = MAX_AGE_PATTERN.search(response.headers.get("cache-control", ""))
+            self._fetched_at = time.time()
+            max_age = int(match.group(1)) if match else self.fallback_max_age_seconds
+            self._expires_at = self._fetched_at + max(max_age, self.min_refresh_seconds)
+            self.fetches += 1
+            return self._keys
+
+    @staticmethod
+    def _load_certificates(certificates: Dict[str, str]) -> Dict[str, Any]:
+        return {kid: x509.load_pem_x509_certificate(pem.encode()).public_key()
+                for kid, pem in certificates.items()}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+class LocalFirebaseKeySet:
+    """Stand-in for Google's signing keys: mints Firebase-shaped ID tokens for tests and local dev"""
+
+    def __init__(self, project_id: str, kid: str = "local-test-key"):
+        self.project_id = project_id
+        self.kid = kid
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def public_keys(self) -> Dict[str, Any]:
+        return {self.kid: self._private_key.public_key()}
+
+    def verifier(self, **kwargs) -> FirebaseTokenVerifier:
+        return FirebaseTokenVerifier(self.project_id, local_keys=self.public_keys(), **kwargs)
+
+    def create_id_token(self, uid: str, phone_number: Optional[str] = None,
+                        expires_in: timedelta = timedelta(hours=1), **claims) -> str:
+        now = int(time.time())
+        payload = {
+            "iss": f"https://securetoken.google.com/{self.project_id}",
+            "aud": self.project_id,
+            "sub": uid,
+            "user_id": uid,
+            "iat": now,
+            "auth_time": now,
+            "exp": now + int(expires_in.total_seconds()),
+            **claims
+        }
+        if phone_number:
+            payload["phone_number"] = phone_number
+        pem = self._private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        )
+        return jwt.encode(payload, pem, algorithm="RS256", headers={"kid": self.kid})
@@ -0,0 +1,177 @@
+from typing import Callable, Optional
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+
+class BloomFilter:
+    """Fixed-size Bloom filter: no false negatives, about error_rate false positives at capacity"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: bytes):
+        # Double hashing (Kirsch-Mitzenmacher) from one 128-bit digest
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: bytes):
+        new = False
+        for position in self._positions(item):
+            bit = 1 << (position & 7)
+            if not self._bits[position >> 3] & bit:
+                self._bits[position >> 3] |= bit
+                new = True
+        if new:  # re-adding a known item does not count towards capacity
+            self.count += 1
+
+    def __contains__(self, item: bytes) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+def jti_key(jti: str) -> bytes:
+    """uuid4().hex jti values are stored as 16 raw bytes; anything else as UTF-8"""
+    if len(jti) == 32:
+        try:
+            return bytes.fromhex(jti)
+        except ValueError:
+            pass
+    return jti.encode()
+
+def jti_from_key(key: bytes) -> str:
+    return key.hex() if len(key) == 16 else key.decode()
+
+class TokenDenylist:
+    """Revoked JWT ids (jti) kept until the token's own exp.
+
+    Rows live in SQLite (16-byte jti + expiry) so revocations survive
+    restarts and are shared by every worker on the host. Each process
+    fronts the table with a Bloom filter: a token that was never revoked
+    is answered from memory, and only Bloom hits (revoked tokens plus
+    ~error_rate false positives) reach the database. Revocations made by
+    other processes are picked up by poll() every sync_interval_seconds.
+    """
+
+    def __init__(self, db_path: str = "revoked_tokens.db", capacity: int = 100000,
+                 error_rate: float = 0.001, sync_interval_seconds: float = 5.0,
+                 purge_interval_seconds: float = 3600.0,
+                 on_revoke: Optional[Callable[[str], None]] = None):
+        self.error_rate = error_rate
+        self.sync_interval_seconds = sync_interval_seconds
+        self.purge_interval_seconds = purge_interval_seconds
+        self.on_revoke = on_revoke
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                jti BLOB NOT NULL UNIQUE,
+                expires_at INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON revoked_tokens(expires_at)"
+        )
+        self._last_seq = 0
+        self._next_sync = 0.0
+        self._next_purge = 0.0
+        self.db_checks = 0
+        self.false_positives = 0
+        with self._lock:
+            self._purge_and_rebuild(capacity)
+            self._last_seq = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM revoked_tokens"
+            ).fetchone()[0]
+
+    def revoke(self, jti: str, exp: float):
+        """Deny jti until exp (the token's own expiry, as a Unix timestamp)"""
+        key = jti_key(jti)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)",
+                (key, int(exp))
+            )
+            self._add(key)
+        if self.on_revoke:
+            self.on_revoke(jti)
+
+    def may_be_revoked(self, jti: str) -> bool:
+        """Bloom check only: False means not revoked; True needs is_revoked()"""
+        return jti_key(jti) in self._bloom
+
+    def poll_due(self) -> bool:
+        return time.monotonic() >= self._next_sync
+
+    def is_revoked(self, jti: str) -> bool:
+        self.poll()
+        key = jti_key(jti)
+        if key not in self._bloom:
+            return False
+        with self._lock:
+            self.db_checks += 1
+            row = self._conn.execute(
+                "SELECT 1 FROM revoked_tokens WHERE jti = ? AND expires_at > ?",
+                (key, int(time.time()))
+            ).fetchone()
+            if row is None:
+                self.false_positives += 1
+        return row is not None
+
+    def poll(self):
+        """Load revocations written by other processes and purge expired rows when due"""
+        if time.monotonic() < self._next_sync:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_sync:
+                return
+            self._next_sync = now + self.sync_interval_seconds
+            if now >= self._next_purge:
+                self._purge_and_rebuild(self._bloom.capacity)
+            rows = self._conn.execute(
+                "SELECT seq, jti FROM revoked_tokens WHERE seq > ? ORDER BY seq", (self._last_seq,)
+            ).fetchall()
+            for seq, key in rows:
+                self._add(key)
+                self._last_seq = seq
+        if self.on_revoke:
+            for _, key in rows:
+                self.on_revoke(jti_from_key(key))
+
+    def _add(self, key: bytes):
+        self._bloom.add(key)
+        if self._bloom.count > self._bloom.capacity:
+            self._rebuild(self._bloom.capacity * 2)
+
+    def _purge_and_rebuild(self, capacity: int):
+        self._conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (int(time.time()),))
+        self._rebuild(capacity)
+        self._next_purge = time.monotonic() + self.purge_interval_seconds
+
+    def _rebuild(self, capacity: int):
+        keys = [key for (key,) in self._conn.execute("SELECT jti FROM revoked_tokens")]
+        while capacity < len(keys):
+            capacity *= 2
+        bloom = BloomFilter(capacity, self.error_rate)
+        for key in keys:
+            bloom.add(key)
+        self._bloom = bloom
+
+    def stats(self) -> dict:
+        return {"bloom_entries": self._bloom.count, "bloom_capacity": self._bloom.capacity,
+                "bloom_bytes": len(self._bloom._bits), "db_checks": self.db_checks,
+                "false_positives": self.false_positives}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+import hashlib
+import threading
+import time
+
+import jwt
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    """Minimal, immutable view of an authenticated user that is safe to cache"""
+    id: str
+    firebase_uid: str
+    name: Optional[str] = None
+    is_active: bool = True
+    is_driver: bool = False
+    is_parent: bool = False
+
+class SigningKeySet:
+    """Active JWT signing keys identified by "kid".
+
+    New tokens are signed with active_kid; tokens signed with any key still
+    in the set keep verifying. To rotate, add the new key, make it active,
+    and drop the old one once its tokens have expired. Tokens issued before
+    kids were used carry no "kid" header and are checked with legacy_kid.
+    on_retire(kid) runs after a key is retired, e.g. to evict that key's
+    tokens from a VerifiedTokenCache.
+    """
+
+    def __init__(self, keys: Dict[str, str], active_kid: str,
+                 algorithm: str = "HS256", legacy_kid: Optional[str] = None,
+                 on_retire: Optional[Callable[[str], Any]] = None):
+        if active_kid not in keys:
+            raise ValueError(f"Active signing key '{active_kid}' is not in the key set")
+        self.keys = dict(keys)
+        self.active_kid = active_kid
+        self.algorithm = algorithm
+        self.legacy_kid = legacy_kid or active_kid
+        self.on_retire = on_retire
+
+    @classmethod
+    def from_config(cls, signing_keys: str, active_kid: str, fallback_secret: str,
+                    algorithm: str = "HS256", legacy_secret: str = "",
+                    on_retire: Optional[Callable[[str], Any]] = None) -> "SigningKeySet":
+        """Build from "kid1:secret1,kid2:secret2"; an empty string uses fallback_secret as kid "default".
+
+        With explicit keys, fallback_secret is ignored. Tokens issued before
+        kids existed only keep verifying if their secret is passed as
+        legacy_secret; leave it empty to retire them.
+        """
+        keys = dict(entry.split(":", 1) for entry in signing_keys.split(",") if entry.strip())
+        if not keys:
+            return cls({"default": fallback_secret}, "default", algorithm, on_retire=on_retire)
+        if not legacy_secret:
+            return cls(keys, active_kid or next(iter(keys)), algorithm, on_retire=on_retire)
+        keys.setdefault("default", legacy_secret)
+        return cls(keys, active_kid or next(iter(keys)), algorithm, legacy_kid="default",
+                   on_retire=on_retire)
+
+    def encode(self, payload: Dict[str, Any]) -> str:
+        return jwt.encode(payload, self.keys[self.active_kid], algorithm=self.algorithm,
+                          headers={"kid": self.active_kid})
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """Verify signature and expiry; raises jwt.InvalidTokenError subclasses"""
+        kid = self.kid_of(token)
+        secret = self.keys.get(kid)
+        if secret is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key '{kid}'")
+        return jwt.decode(token, secret, algorithms=[self.algorithm])
+
+    def kid_of(self, token: str) -> str:
+        return jwt.get_unverified_header(token).get("kid") or self.legacy_kid
+
+    def retire(self, kid: str):
+        if kid == self.active_kid:
+            raise ValueError("Cannot retire the active signing key")
+        self.keys.pop(kid, None)
+        if self.on_retire:
+            self.on_retire(kid)
+
+class VerifiedTokenCache:
+    """Bounded LRU cache of verified tokens -> principal.
+
+    Keyed by a SHA-256 digest of the token, so repeat requests skip both
+    the HMAC check and the user lookup. An entry never outlives the token's
+    own exp (nor max_ttl_seconds, which bounds how stale a cached principal
+    can get). Entries remember their signing kid so that retiring one key
+    only evicts that key's tokens, and their jti so a revoked token can be
+    dropped.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.max_ttl_seconds = max_ttl_seconds
+        self._entries = OrderedDict()  # digest -> (principal, expires_at, kid, user_id, jti)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Any]:
+        digest = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] <= time.time():
+                del self._entries[digest]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, principal: Any, exp: float, kid: str, user_id: str,
+            jti: Optional[str] = None):
+        expires_at = min(exp, time.time() + self.max_ttl_seconds)
+        if expires_at <= time.time():
+            return
+        digest = self.digest(token)
+        with self._lock:
+            self._entries[digest] = (principal, expires_at, kid, user_id, jti)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def evict_token(self, token: str):
+        with self._lock:
+            if self._entries.pop(self.digest(token), None) is not None:
+                self.evictions += 1
+
+    def evict_where(self, kid: str = None, user_id: str = None, jti: str = None) -> int:
+        """Drop entries matching every given kid, user_id and jti"""
+        with self._lock:
+            stale = [digest for digest, (_, _, entry_kid, entry_user, entry_jti) in self._entries.items()
+                     if (kid is None or entry_kid == kid)
+                     and (user_id is None or entry_user == user_id)
+                     and (jti is None or entry_jti == jti)]
+            for digest in stale:
+                del self._entries[digest]
+            self.evictions += len(stale)
+            return len(stale)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
@@ -2,6 +2,8 @@ from sqlalchemy import Column, String, DateTime, Boolean, Text, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
+import hashlib
+import secrets
 import uuid
 
 Base = declarative_base()
@@ -70,15 +72,121 @@ class Child(Base):
     # Relationship
     parent = relationship("ParentProfile", back_populates="children")
 
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    
+    id = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String, nullable=False)  # SHA-256 of the secret part; the token itself is never stored
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)  # set when rotated or revoked
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+def new_refresh_token(user_id: str, expires_at: datetime) -> tuple[str, RefreshToken]:
+    """Opaque "<id>.<secret>" refresh token and the row that stores its hash"""
+    secret = secrets.token_urlsafe(32)
+    row = RefreshToken(
+        id=f"rft_{uuid.uuid4().hex}",
+        user_id=user_id,
+        token_hash=hashlib.sha256(secret.encode()).hexdigest(),
+        expires_at=expires_at
+    )
+    return f"{row.id}.{secret}", row
+
+def parse_refresh_token(token: str) -> tuple[str, str]:
+    """(id, token_hash) of a refresh token, or (None, None) if it is malformed"""
+    token_id, _, secret = token.partition(".")
+    if not token_id.startswith("rft_") or not secret:
+        return None, None
+    return token_id, hashlib.sha256(secret.encode()).hexdigest()
+
 # Database operations example
-from sqlalchemy.orm import Session
+from typing import Dict, List
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+# Named eager-loading profiles. Each relationship costs one JOIN or one
+# extra IN query for the whole result, never one query per row. Getters
+# always query (never session.get's identity-map shortcut), so relationships
+# missing on users already in the session are loaded too; pending edits on
+# those users are kept.
+LOAD_PROFILES = {
+    "basic": (),
+    "driver": (joinedload(User.driver_profile),),
+    "parent": (joinedload(User.parent_profile).selectinload(ParentProfile.children),),
+    "full": (
+        joinedload(User.driver_profile),
+        joinedload(User.parent_profile).selectinload(ParentProfile.children),
+    ),
+}
+
+def load_options(profile: str) -> tuple:
+    try:
+        return LOAD_PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Unknown loading profile '{profile}', expected one of {sorted(LOAD_PROFILES)}")
+
+def in_order(ids: List[str], rows) -> list:
+    """Rows keyed by id, returned in the order of ids (missing ids skipped)"""
+    by_id = {row.id: row for row in rows}
+    return [by_id[row_id] for row_id in ids if row_id in by_id]
+
+def group_children(parent_ids: List[str], children) -> Dict[str, List[Child]]:
+    grouped = {parent_id: [] for parent_id in parent_ids}
+    for child in children:
+        grouped[child.parent_id].append(child)
+    return grouped
+
+def attach_driver_profile(session: Session, driver_profile: DriverProfile):
+    """Show a new profile on its user if that user is already in the session.
+    
+    Getters do not overwrite loaded attributes, so without this a user
+    loaded with the "driver" profile would keep driver_profile=None.
+    """
+    user = session.identity_map.get(session.identity_key(User, driver_profile.user_id))
+    if user is not None:
+        set_committed_value(user, "driver_profile", driver_profile)
+
+# Dialects with INSERT ... ON CONFLICT ... RETURNING
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def upsert_user_statement(dialect_name: str, user_id: str, firebase_uid: str, phone_hash: str,
+                          name: str = None):
+    """Single-statement get-or-create for a phone login, or None if the dialect lacks it.
+    
+    DO NOTHING would return no row when the user already exists, so the
+    conflict branch does a no-op update instead; RETURNING then yields the
+    row either way and concurrent first logins cannot raise IntegrityError.
+    """
+    insert = UPSERT_INSERTS.get(dialect_name)
+    if insert is None:
+        return None
+    now = datetime.utcnow()
+    stmt = insert(User).values(
+        id=user_id,
+        firebase_uid=firebase_uid,
+        phone_hash=phone_hash,
+        name=name,
+        is_active=True,
+        is_driver=False,
+        is_parent=False,
+        created_at=now,
+        updated_at=now
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[User.firebase_uid],
+        set_={"firebase_uid": stmt.excluded.firebase_uid}
+    ).returning(User)
 
 class UserRepository:
     def __init__(self, db: Session):
         self.db = db
     
-    def get_user_by_firebase_uid(self, firebase_uid: str) -> User:
-        return self.db.query(User).filter(User.firebase_uid == firebase_uid).first()
+    def get_user_by_firebase_uid(self, firebase_uid: str, profile: str = "basic") -> User:
+        return (self.db.query(User).options(*load_options(profile))
+                .filter(User.firebase_uid == firebase_uid).first())
     
     def create_user(self, firebase_uid: str, phone_hash: str, name: str = None) -> User:
         user = User(
@@ -91,13 +199,59 @@ class UserRepository:
         self.db.refresh(user)
         return user
     
-    def get_user_by_id(self, user_id: str) -> User:
-        return self.db.query(User).filter(User.id == user_id).first()
+    def get_user_by_id(self, user_id: str, profile: str = "basic") -> User:
+        return (self.db.query(User).options(*load_options(profile))
+                .filter(User.id == user_id).first())
+    
+    def get_users_by_ids(self, user_ids: List[str], profile: str = "basic") -> List[User]:
+        """Batch get in input order; a constant number of queries for any number of ids"""
+        if not user_ids:
+            return []
+        users = (self.db.query(User).options(*load_options(profile))
+                 .filter(User.id.in_(user_ids)).all())
+        return in_order(user_ids, users)
+    
+    def get_children_for_parents(self, parent_ids: List[str]) -> Dict[str, List[Child]]:
+        """Children grouped by ParentProfile id, in one query"""
+        if not parent_ids:
+            return {}
+        children = (self.db.query(Child).filter(Child.parent_id.in_(parent_ids))
+                    .order_by(Child.parent_id, Child.created_at).all())
+        return group_children(parent_ids, children)
+    
+    def list_parents(self, limit: int = 100, offset: int = 0) -> List[ParentProfile]:
+        """Parent profiles with their user and children loaded (two queries per page)"""
+        return (self.db.query(ParentProfile)
+                .options(joinedload(ParentProfile.user), selectinload(ParentProfile.children))
+                .order_by(ParentProfile.created_at, ParentProfile.id)
+                .limit(limit).offset(offset).all())
+    
+    def get_user_by_phone_hash(self, phone_hash: str) -> User:
+        return self.db.query(User).filter(User.phone_hash == phone_hash).first()
+    
+    def get_or_create_user(self, firebase_uid: str, phone_hash: str, name: str = None) -> tuple[User, bool]:
+        """Return (user, created) for a phone login in one round trip"""
+        new_id = f"usr_{uuid.uuid4().hex[:12]}"
+        stmt = upsert_user_statement(self.db.get_bind().dialect.name, new_id, firebase_uid, phone_hash, name)
+        if stmt is None:
+            user = self.get_user_by_firebase_uid(firebase_uid)
+            if user is not None:
+                return user, False
+            return self.create_user(firebase_uid, phone_hash, name), True
+        
+        user = self.db.scalars(stmt, execution_options={"populate_existing": True}).one()
+        self.db.commit()
+        return user, user.id == new_id
     
     def create_driver_profile(self, user_id: str, license_number: str, **kwargs) -> DriverProfile:
-        # Update user to be a driver
-        user = self.get_user_by_id(user_id)
-        user.is_driver = True
+        # Flag the user as a driver without a SELECT; profile and flag commit together
+        result = self.db.execute(
+            update(User).where(User.id == user_id)
+            .values(is_driver=True, updated_at=datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            self.db.rollback()
+            raise ValueError(f"User '{user_id}' not found")
         
         driver_profile = DriverProfile(
             user_id=user_id,
@@ -106,5 +260,201 @@ class UserRepository:
         )
         self.db.add(driver_profile)
         self.db.commit()
-        self.db.refresh(driver_profile)
-        return driver_profile
\ No newline at end of file
+        attach_driver_profile(self.db, driver_profile)
+        return driver_profile
+    
+    def create_refresh_token(self, user_id: str, expires_at: datetime) -> str:
+        token, row = new_refresh_token(user_id, expires_at)
+        self.db.add(row)
+        self.db.commit()
+        return token
+    
+    def rotate_refresh_token(self, token: str, expires_at: datetime) -> tuple[User, str] | None:
+        """Spend a refresh token and issue its replacement; None if it is not valid.
+        
+        The spend is one conditional UPDATE, so concurrent refreshes with the
+        same token cannot both succeed. Presenting an already spent token
+        means it leaked: every refresh token of that user is revoked.
+        """
+        token_id, token_hash = parse_refresh_token(token)
+        if token_id is None:
+            return None
+        now = datetime.utcnow()
+        user_id = self.db.scalar(
+            update(RefreshToken)
+            .where(RefreshToken.id == token_id, RefreshToken.token_hash == token_hash,
+                   RefreshToken.revoked_at.is_(None), RefreshToken.expires_at > now)
+            .values(revoked_at=now)
+            .returning(RefreshToken.user_id)
+        )
+        if user_id is None:
+            reused_by = self.db.scalar(
+                select(RefreshToken.user_id)
+                .where(RefreshToken.id == token_id, RefreshToken.token_hash == token_hash,
+                       RefreshToken.revoked_at.is_not(None))
+            )
+            if reused_by is not None:
+                self.revoke_refresh_tokens(reused_by)
+            return None
+        
+        user = self.get_user_by_id(user_id)
+        if user is None or not user.is_active:
+            self.db.commit()
+            return None
+        new_token, row = new_refresh_token(user_id, expires_at)
+        self.db.add(row)
+        self.db.commit()
+        return user, new_token
+    
+    def revoke_refresh_tokens(self, user_id: str) -> int:
+        result = self.db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=datetime.utcnow())
+        )
+        self.db.commit()
+        return result.rowcount
+
+# Async variant for AsyncSession (see database.py in dependency_config.py)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+class AsyncUserRepository:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+    
+    async def get_user_by_firebase_uid(self, firebase_uid: str, profile: str = "basic") -> User:
+        return await self.db.scalar(
+            select(User).options(*load_options(profile)).where(User.firebase_uid == firebase_uid)
+        )
+    
+    async def create_user(self, firebase_uid: str, phone_hash: str, name: str = None) -> User:
+        user = User(
+            firebase_uid=firebase_uid,
+            phone_hash=phone_hash,
+            name=name
+        )
+        self.db.add(user)
+        await self.db.commit()
+        await self.db.refresh(user)
+        return user
+    
+    async def get_user_by_id(self, user_id: str, profile: str = "basic") -> User:
+        return await self.db.scalar(select(User).options(*load_options(profile)).where(User.id == user_id))
+    
+    async def get_users_by_ids(self, user_ids: List[str], profile: str = "basic") -> List[User]:
+        """Batch get in input order; a constant number of queries for any number of ids"""
+        if not user_ids:
+            return []
+        users = await self.db.scalars(
+            select(User).options(*load_options(profile)).where(User.id.in_(user_ids))
+        )
+        return in_order(user_ids, users)
+    
+    async def get_children_for_parents(self, parent_ids: List[str]) -> Dict[str, List[Child]]:
+        """Children grouped by ParentProfile id, in one query"""
+        if not parent_ids:
+            return {}
+        children = await self.db.scalars(
+            select(Child).where(Child.parent_id.in_(parent_ids))
+            .order_by(Child.parent_id, Child.created_at)
+        )
+        return group_children(parent_ids, children)
+    
+    async def list_parents(self, limit: int = 100, offset: int = 0) -> List[ParentProfile]:
+        """Parent profiles with their user and children loaded (two queries per page)"""
+        parents = await self.db.scalars(
+            select(ParentProfile)
+            .options(joinedload(ParentProfile.user), selectinload(ParentProfile.children))
+            .order_by(ParentProfile.created_at, ParentProfile.id)
+            .limit(limit).offset(offset)
+        )
+        return list(parents)
+    
+    async def get_user_by_phone_hash(self, phone_hash: str) -> User:
+        return await self.db.scalar(select(User).where(User.phone_hash == phone_hash))
+    
+    async def get_or_create_user(self, firebase_uid: str, phone_hash: str, name: str = None) -> tuple[User, bool]:
+        """Return (user, created) for a phone login in one round trip"""
+        new_id = f"usr_{uuid.uuid4().hex[:12]}"
+        stmt = upsert_user_statement(self.db.get_bind().dialect.name, new_id, firebase_uid, phone_hash, name)
+        if stmt is None:
+            user = await self.get_user_by_firebase_uid(firebase_uid)
+            if user is not None:
+                return user, False
+            return await self.create_user(firebase_uid, phone_hash, name), True
+        
+        user = (await self.db.scalars(stmt, execution_options={"populate_existing": True})).one()
+        await self.db.commit()
+        return user, user.id == new_id
+    
+    async def create_driver_profile(self, user_id: str, license_number: str, **kwargs) -> DriverProfile:
+        # Flag the user as a driver without a SELECT; profile and flag commit together
+        result = await self.db.execute(
+            update(User).where(User.id == user_id)
+            .values(is_driver=True, updated_at=datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            await self.db.rollback()
+            raise ValueError(f"User '{user_id}' not found")
+        
+        driver_profile = DriverProfile(
+            user_id=user_id,
+            license_number=license_number,
+            **kwargs
+        )
+        self.db.add(driver_profile)
+        await self.db.commit()
+        attach_driver_profile(self.db.sync_session, driver_profile)
+        return driver_profile
+    
+    async def create_refresh_token(self, user_id: str, expires_at: datetime) -> str:
+        token, row = new_refresh_token(user_id, expires_at)
+        self.db.add(row)
+        await self.db.commit()
+        return token
+    
+    async def rotate_refresh_token(self, token: str, expires_at: datetime) -> tuple[User, str] | None:
+        """Spend a refresh token and issue its replacement; None if it is not valid.
+        
+        The spend is one conditional UPDATE, so concurrent refreshes with the
+        same token cannot both succeed. Presenting an already spent token
+        means it leaked: every refresh token of that user is revoked.
+        """
+        token_id, token_hash = parse_refresh_token(token)
+        if token_id is None:
+            return None
+        now = datetime.utcnow()
+        user_id = await self.db.scalar(
+            update(RefreshToken)
+            .where(RefreshToken.id == token_id, RefreshToken.token_hash == token_hash,
+                   RefreshToken.revoked_at.is_(None), RefreshToken.expires_at > now)
+            .values(revoked_at=now)
+            .returning(RefreshToken.user_id)
+        )
+        if user_id is None:
+            reused_by = await self.db.scalar(
+                select(RefreshToken.user_id)
+                .where(RefreshToken.id == token_id, RefreshToken.token_hash == token_hash,
+                       RefreshToken.revoked_at.is_not(None))
+            )
+            if reused_by is not None:
+                await self.revoke_refresh_tokens(reused_by)
+            return None
+        
+        user = await self.get_user_by_id(user_id)
+        if user is None or not user.is_active:
+            await self.db.commit()
+            return None
+        new_token, row = new_refresh_token(user_id, expires_at)
+        self.db.add(row)
+        await self.db.commit()
+        return user, new_token
+    
+    async def revoke_refresh_tokens(self, user_id: str) -> int:
+        result = await self.db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=datetime.utcnow())
+        )
+        await self.db.commit()
+        return result.rowcount
\ No newline at end of file
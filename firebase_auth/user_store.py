@@ -0,0 +1,248 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import secrets
+import threading
+import uuid
+
+# Same names as LOAD_PROFILES in user_db_sample.py; records always hold their relationships
+LOAD_PROFILES = ("basic", "driver", "parent", "full")
+
+def check_profile(profile: str):
+    if profile not in LOAD_PROFILES:
+        raise ValueError(f"Unknown loading profile '{profile}', expected one of {sorted(LOAD_PROFILES)}")
+
+class UserRecord:
+    """In-memory counterpart of the User model in user_db_sample.py"""
+    __slots__ = ("id", "firebase_uid", "phone_hash", "name", "email", "is_active",
+                 "is_driver", "is_parent", "created_at", "updated_at", "driver_profile",
+                 "parent_profile")
+
+    def __init__(self, firebase_uid: str, phone_hash: str, name: str = None, email: str = None):
+        now = datetime.utcnow()
+        self.id = f"usr_{uuid.uuid4().hex[:12]}"
+        self.firebase_uid = firebase_uid
+        self.phone_hash = phone_hash
+        self.name = name
+        self.email = email
+        self.is_active = True
+        self.is_driver = False
+        self.is_parent = False
+        self.created_at = now
+        self.updated_at = now
+        self.driver_profile = None
+        self.parent_profile = None
+
+class DriverProfileRecord:
+    """In-memory counterpart of the DriverProfile model in user_db_sample.py"""
+    __slots__ = ("id", "user_id", "license_number", "license_expiry", "vehicle_registration",
+                 "vehicle_model", "vehicle_capacity", "background_check_status", "is_verified",
+                 "created_at")
+
+    def __init__(self, user_id: str, license_number: str, license_expiry: datetime = None,
+                 vehicle_registration: str = None, vehicle_model: str = None,
+                 vehicle_capacity: str = None, background_check_status: str = "pending",
+                 is_verified: bool = False):
+        self.id = f"drv_{uuid.uuid4().hex[:12]}"
+        self.user_id = user_id
+        self.license_number = license_number
+        self.license_expiry = license_expiry
+        self.vehicle_registration = vehicle_registration
+        self.vehicle_model = vehicle_model
+        self.vehicle_capacity = vehicle_capacity
+        self.background_check_status = background_check_status
+        self.is_verified = is_verified
+        self.created_at = datetime.utcnow()
+
+class ParentProfileRecord:
+    """In-memory counterpart of the ParentProfile model in user_db_sample.py"""
+    __slots__ = ("id", "user_id", "emergency_contact", "address", "created_at", "user", "children")
+
+    def __init__(self, user: UserRecord, emergency_contact: str = None, address: str = None):
+        self.id = f"par_{uuid.uuid4().hex[:12]}"
+        self.user_id = user.id
+        self.emergency_contact = emergency_contact
+        self.address = address
+        self.created_at = datetime.utcnow()
+        self.user = user
+        self.children: List["ChildRecord"] = []
+
+class ChildRecord:
+    """In-memory counterpart of the Child model in user_db_sample.py"""
+    __slots__ = ("id", "parent_id", "name", "school_name", "grade", "pickup_address",
+                 "drop_address", "emergency_contact", "created_at")
+
+    def __init__(self, parent_id: str, name: str, school_name: str = None, grade: str = None,
+                 pickup_address: str = None, drop_address: str = None, emergency_contact: str = None):
+        self.id = f"chd_{uuid.uuid4().hex[:12]}"
+        self.parent_id = parent_id
+        self.name = name
+        self.school_name = school_name
+        self.grade = grade
+        self.pickup_address = pickup_address
+        self.drop_address = drop_address
+        self.emergency_contact = emergency_contact
+        self.created_at = datetime.utcnow()
+
+class RefreshTokenRecord:
+    """In-memory counterpart of the RefreshToken model in user_db_sample.py"""
+    __slots__ = ("id", "user_id", "token_hash", "expires_at", "revoked_at", "created_at")
+
+    def __init__(self, user_id: str, token_hash: str, expires_at: datetime):
+        self.id = f"rft_{uuid.uuid4().hex}"
+        self.user_id = user_id
+        self.token_hash = token_hash
+        self.expires_at = expires_at
+        self.revoked_at = None
+        self.created_at = datetime.utcnow()
+
+def hash_refresh_secret(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+class InMemoryUserRepository:
+    """Drop-in for UserRepository without a database.
+
+    Users are indexed by id, firebase_uid and phone_hash, so every lookup is
+    a dict hit rather than a scan. A single lock makes create and
+    get-or-create atomic when handlers run on several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_id: Dict[str, UserRecord] = {}
+        self._by_firebase_uid: Dict[str, UserRecord] = {}
+        self._by_phone_hash: Dict[str, UserRecord] = {}
+        self._parents: Dict[str, ParentProfileRecord] = {}  # creation order, like list_parents in SQL
+        self._refresh_tokens: Dict[str, RefreshTokenRecord] = {}
+        self._refresh_ids_by_user: Dict[str, set] = {}
+        self._refresh_purge_at = 1024  # drop expired refresh tokens once this many are stored
+
+    def get_user_by_firebase_uid(self, firebase_uid: str, profile: str = "basic") -> Optional[UserRecord]:
+        check_profile(profile)
+        return self._by_firebase_uid.get(firebase_uid)
+
+    def get_user_by_phone_hash(self, phone_hash: str) -> Optional[UserRecord]:
+        return self._by_phone_hash.get(phone_hash)
+
+    def get_user_by_id(self, user_id: str, profile: str = "basic") -> Optional[UserRecord]:
+        check_profile(profile)
+        return self._by_id.get(user_id)
+
+    def get_users_by_ids(self, user_ids: List[str], profile: str = "basic") -> List[UserRecord]:
+        """Batch get in input order (missing ids skipped)"""
+        check_profile(profile)
+        return [self._by_id[user_id] for user_id in user_ids if user_id in self._by_id]
+
+    def get_children_for_parents(self, parent_ids: List[str]) -> Dict[str, List[ChildRecord]]:
+        """Children grouped by parent profile id"""
+        return {parent_id: list(self._parents[parent_id].children) if parent_id in self._parents else []
+                for parent_id in parent_ids}
+
+    def list_parents(self, limit: int = 100, offset: int = 0) -> List[ParentProfileRecord]:
+        return list(self._parents.values())[offset:offset + limit]
+
+    def create_user(self, firebase_uid: str, phone_hash: str, name: str = None) -> UserRecord:
+        with self._lock:
+            if firebase_uid in self._by_firebase_uid:
+                raise ValueError(f"User with firebase_uid '{firebase_uid}' already exists")
+            user = UserRecord(firebase_uid=firebase_uid, phone_hash=phone_hash, name=name)
+            self._by_id[user.id] = user
+            self._by_firebase_uid[firebase_uid] = user
+            # phone_hash is not unique in SQL either; lookups return the first user
+            self._by_phone_hash.setdefault(phone_hash, user)
+            return user
+
+    def get_or_create_user(self, firebase_uid: str, phone_hash: str,
+                           name: str = None) -> Tuple[UserRecord, bool]:
+        """Return (user, created); concurrent first logins for one uid create a single user"""
+        user = self._by_firebase_uid.get(firebase_uid)
+        if user is not None:
+            return user, False
+        with self._lock:
+            user = self._by_firebase_uid.get(firebase_uid)
+            if user is not None:
+                return user, False
+            return self.create_user(firebase_uid, phone_hash, name), True
+
+    def create_driver_profile(self, user_id: str, license_number: str, **kwargs) -> DriverProfileRecord:
+        with self._lock:
+            user = self._by_id.get(user_id)
+            if user is None:
+                raise ValueError(f"User '{user_id}' not found")
+            driver_profile = DriverProfileRecord(user_id=user_id, license_number=license_number, **kwargs)
+            user.driver_profile = driver_profile
+            user.is_driver = True
+            user.updated_at = datetime.utcnow()
+            return driver_profile
+
+    def create_parent_profile(self, user_id: str, **kwargs) -> ParentProfileRecord:
+        with self._lock:
+            user = self._by_id.get(user_id)
+            if user is None:
+                raise ValueError(f"User '{user_id}' not found")
+            parent_profile = ParentProfileRecord(user, **kwargs)
+            self._parents[parent_profile.id] = parent_profile
+            user.parent_profile = parent_profile
+            user.is_parent = True
+            user.updated_at = datetime.utcnow()
+            return parent_profile
+
+    def add_child(self, parent_id: str, name: str, **kwargs) -> ChildRecord:
+        with self._lock:
+            parent_profile = self._parents.get(parent_id)
+            if parent_profile is None:
+                raise ValueError(f"Parent profile '{parent_id}' not found")
+            child = ChildRecord(parent_id, name, **kwargs)
+            parent_profile.children.append(child)
+            return child
+
+    def create_refresh_token(self, user_id: str, expires_at: datetime) -> str:
+        """Opaque "<id>.<secret>" token; only a SHA-256 of the secret is kept"""
+        secret = secrets.token_urlsafe(32)
+        record = RefreshTokenRecord(user_id, hash_refresh_secret(secret), expires_at)
+        with self._lock:
+            self._refresh_tokens[record.id] = record
+            self._refresh_ids_by_user.setdefault(user_id, set()).add(record.id)
+            if len(self._refresh_tokens) >= self._refresh_purge_at:
+                now = datetime.utcnow()
+                for token_id in [token_id for token_id, stored in self._refresh_tokens.items()
+                                 if stored.expires_at <= now]:
+                    stored = self._refresh_tokens.pop(token_id)
+                    self._refresh_ids_by_user[stored.user_id].discard(token_id)
+                self._refresh_purge_at = max(1024, 2 * len(self._refresh_tokens))
+        return f"{record.id}.{secret}"
+
+    def rotate_refresh_token(self, token: str, expires_at: datetime) -> Optional[Tuple[UserRecord, str]]:
+        """Spend a refresh token and issue its replacement; None if it is not valid.
+
+        Presenting an already spent token means it leaked: every refresh
+        token of that user is revoked, as in UserRepository.
+        """
+        token_id, _, secret = token.partition(".")
+        now = datetime.utcnow()
+        with self._lock:
+            record = self._refresh_tokens.get(token_id)
+            if record is None or not secret or not secrets.compare_digest(
+                    record.token_hash, hash_refresh_secret(secret)):
+                return None
+            if record.revoked_at is not None:
+                self.revoke_refresh_tokens(record.user_id)
+                return None
+            if record.expires_at <= now:
+                return None
+            record.revoked_at = now
+            user = self._by_id.get(record.user_id)
+            if user is None or not user.is_active:
+                return None
+            return user, self.create_refresh_token(user.id, expires_at)
+
+    def revoke_refresh_tokens(self, user_id: str) -> int:
+        now = datetime.utcnow()
+        revoked = 0
+        with self._lock:
+            for token_id in self._refresh_ids_by_user.get(user_id, ()):
+                record = self._refresh_tokens[token_id]
+                if record.revoked_at is None:
+                    record.revoked_at = now
+                    revoked += 1
+        return revoked